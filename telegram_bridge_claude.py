@@ -17,13 +17,21 @@ import json
 import asyncio
 import subprocess
 import re
-import glob
+import shutil
+import signal
+import threading
+import atexit
+import codecs
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, List, Tuple
-from dataclasses import dataclass, field, asdict
+from typing import Optional, Tuple, Deque, List, Callable, Awaitable
+from dataclasses import dataclass, field
+from collections import deque
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 # === Load .env ===
 try:
@@ -32,14 +40,39 @@ try:
 except ImportError:
     pass  # dotenv is optional if env vars are set externally
 
+# orjson is optional: a C encoder that emits UTF-8 bytes directly; fall back to stdlib json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# uvloop is optional (POSIX only): a libuv event loop with cheaper subprocess pipes and sockets
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = sys.platform != "win32"
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+def _dumps(obj) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes (non-ASCII left unescaped)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+def _loads(data):
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
 # === Configuration ===
 BASE_DIR = Path(__file__).parent.resolve()
 
-def _parse_user_ids(raw: str) -> list:
-    """Parse comma-separated user IDs from env var."""
+def _parse_user_ids(raw: str) -> frozenset:
+    """Parse comma-separated user IDs from env var (a set: checked on every update)."""
     if not raw:
-        return []
-    return [int(uid.strip()) for uid in raw.split(",") if uid.strip().isdigit()]
+        return frozenset()
+    return frozenset(int(uid.strip()) for uid in raw.split(",") if uid.strip().isdigit())
 
 CONFIG = {
     "TELEGRAM_BOT_TOKEN": os.getenv("TELEGRAM_BOT_TOKEN", ""),
@@ -47,17 +80,28 @@ CONFIG = {
     "CLAUDE_CLI": os.getenv("CLAUDE_CLI_PATH", "claude"),
     "WORKING_DIR": Path(os.getenv("WORKING_DIR", str(Path.home() / "claude-workspace"))),
     "BASE_DIR": BASE_DIR,
-    "HISTORY_FILE": BASE_DIR / "conversation_history.json",
+    "HISTORY_FILE": BASE_DIR / "conversation_history.jsonl",
     "LOG_DIR": BASE_DIR / "logs",
     "TIMEOUT": int(os.getenv("TIMEOUT", "300")),
     "MAX_HISTORY_ROUNDS": int(os.getenv("MAX_HISTORY_ROUNDS", "10")),
     "ALLOW_DANGEROUS": os.getenv("ALLOW_DANGEROUS", "false").lower() == "true",
     "LOG_RETENTION_DAYS": int(os.getenv("LOG_RETENTION_DAYS", "14")),
+    "LOG_CONSOLE": os.getenv("LOG_CONSOLE", "auto").lower(),
     "URL_FETCH_TIMEOUT": int(os.getenv("URL_FETCH_TIMEOUT", "15")),
+    "URL_TOTAL_TIMEOUT": float(os.getenv("URL_TOTAL_TIMEOUT", "45")),
     "FETCH_OUTPUT_DIR": BASE_DIR / "fetch_outputs",
     "IMAGE_ANALYSIS_ENABLED": os.getenv("IMAGE_ANALYSIS_ENABLED", "true").lower() == "true",
     "MAX_IMAGES_PER_MESSAGE": int(os.getenv("MAX_IMAGES_PER_MESSAGE", "5")),
     "IMAGE_ANALYSIS_TIMEOUT": int(os.getenv("IMAGE_ANALYSIS_TIMEOUT", "30")),
+    "GEMINI_CONCURRENCY": int(os.getenv("GEMINI_CONCURRENCY", "4")),
+    "URL_FETCH_CONCURRENCY": int(os.getenv("URL_FETCH_CONCURRENCY", "8")),
+    "URL_FETCH_PER_HOST": int(os.getenv("URL_FETCH_PER_HOST", "2")),
+    "URL_CACHE_SIZE": int(os.getenv("URL_CACHE_SIZE", "512")),
+    "URL_CACHE_TTL": int(os.getenv("URL_CACHE_TTL", "900")),
+    "BRIDGE_IO_THREADS": int(os.getenv("BRIDGE_IO_THREADS", "8")),
+    "CLAUDE_PREWARM": os.getenv("CLAUDE_PREWARM", "true").lower() == "true",
+    "STREAM_EDIT_INTERVAL": float(os.getenv("STREAM_EDIT_INTERVAL", "1.0")),
+    "HISTORY_SAVE_DELAY": float(os.getenv("HISTORY_SAVE_DELAY", "2.0")),
 }
 
 CONFIG["WORKING_DIR"].mkdir(parents=True, exist_ok=True)
@@ -76,29 +120,41 @@ def setup_logging():
     )
     file_handler.suffix = "%Y-%m-%d.log"
     file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    handlers = [file_handler]
+
+    # Mirror to the console only when someone can see it (or when asked to); a daemonized
+    # run would otherwise write every record twice
+    console = CONFIG["LOG_CONSOLE"]
+    if console == "true" or (console == "auto" and sys.stderr is not None and sys.stderr.isatty()):
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        handlers.append(console_handler)
+
+    # The event loop only enqueues records; a listener thread does the formatting and I/O
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
     return logging.getLogger(__name__)
 
 def cleanup_old_logs():
-    cutoff_date = datetime.now() - timedelta(days=CONFIG["LOG_RETENTION_DAYS"])
-    log_pattern = CONFIG["LOG_DIR"] / "bridge.log.*"
+    # TimedRotatingFileHandler only prunes on rollover, so a bot restarted before
+    # midnight would never drop old files; sweep once at startup by mtime.
+    retention_days = CONFIG["LOG_RETENTION_DAYS"]
+    with os.scandir(CONFIG["LOG_DIR"]) as it:
+        rotated = [e for e in it if e.name.startswith("bridge.log.")]
+    cutoff_ts = (datetime.now() - timedelta(days=retention_days)).timestamp()
     deleted_count = 0
-    for log_file in glob.glob(str(log_pattern)):
+    for entry in rotated:
         try:
-            date_str = log_file.split('.')[-1].replace('.log', '')
-            file_date = datetime.strptime(date_str, "%Y-%m-%d")
-            if file_date < cutoff_date:
-                os.remove(log_file)
+            if entry.is_file() and entry.stat().st_mtime < cutoff_ts:
+                os.unlink(entry.path)
                 deleted_count += 1
-        except (ValueError, OSError):
+        except OSError:
             continue
     if deleted_count > 0:
-        logging.info(f"Cleaned up {deleted_count} log files older than {CONFIG['LOG_RETENTION_DAYS']} days")
+        logging.info(f"Cleaned up {deleted_count} log files older than {retention_days} days")
 
 logger = setup_logging()
 
@@ -112,127 +168,212 @@ except ImportError:
 
 from url_fetchers import (
     detect_urls, preprocess_urls, save_fetch_output, extract_structured_data,
-    REQUESTS_AVAILABLE, YTDLP_AVAILABLE, LANGEXTRACT_AVAILABLE,
+    close_http_client, HTTPX_AVAILABLE, YTDLP_AVAILABLE, LANGEXTRACT_AVAILABLE,
 )
 from vision import GENAI_AVAILABLE
 
 
 # === Conversation History ===
 
-@dataclass
+# Per-message character budget in the history context sent to Claude
+CONTEXT_PREVIEW_CHARS = 500
+
+@dataclass(slots=True)
 class Message:
     role: str
     content: str
-    timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+    # Epoch seconds; formatted to ISO (second resolution) only when persisted
+    timestamp: float = field(default_factory=time.time)
+    # Trimmed form used in the context summary; only set for long messages, never persisted
+    preview: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if len(self.content) > CONTEXT_PREVIEW_CHARS:
+            self.preview = self.content[:CONTEXT_PREVIEW_CHARS] + "..."
+
+    def to_dict(self) -> dict:
+        return {
+            "role": self.role,
+            "content": self.content,
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat(timespec='seconds'),
+        }
 
-class ConversationHistory:
-    def __init__(self, max_rounds: int = 10):
-        self.max_messages = max_rounds * 2
-        self.messages: List[Message] = []
+    @classmethod
+    def from_dict(cls, data: dict) -> "Message":
+        ts = data.get("timestamp")
+        return cls(
+            data["role"], data["content"],
+            datetime.fromisoformat(ts).timestamp() if ts else time.time(),
+        )
 
-    def add_user_message(self, content: str) -> None:
-        self.messages.append(Message(role="user", content=content))
-        self._trim()
+class ConversationHistory:
+    """
+    Rolling conversation window persisted as append-only JSONL (one Message per line).
+    Each turn appends a single line; the file is rewritten only on /clear or when
+    it grows past COMPACT_FACTOR times the in-memory window. ClaudeBridge's saver
+    task is the only caller of append()/save() once the bot is running.
+    """
 
-    def add_assistant_message(self, content: str) -> None:
-        self.messages.append(Message(role="assistant", content=content))
-        self._trim()
+    COMPACT_FACTOR = 2
 
-    def _trim(self) -> None:
-        while len(self.messages) > self.max_messages:
-            self.messages.pop(0)
+    def __init__(self, max_rounds: int = 10):
+        self.max_messages = max_rounds * 2
+        # Bounded deque: appends evict the oldest message in O(1)
+        self.messages: Deque[Message] = deque(maxlen=self.max_messages)
+        self._lines_on_disk = 0
+        # Set by load() when the file ends mid-line (a write cut short by a crash); the next
+        # append() starts with a newline so its first record doesn't get glued onto the stub
+        self._missing_newline = False
+        # Rendered get_context_summary(); reset by every mutator below
+        self._summary_cache: Optional[str] = None
+        # Most recent message of each role, for /fetch and /extract without a reverse scan
+        self.last_user: Optional[Message] = None
+        self.last_assistant: Optional[Message] = None
+        # append()/save() run on executor threads; serialize them so writes never interleave
+        self._io_lock = threading.Lock()
+
+    def add_user_message(self, content: str) -> Message:
+        msg = Message(role="user", content=content)
+        self.messages.append(msg)
+        self._summary_cache = None
+        self.last_user = msg
+        return msg
+
+    def add_assistant_message(self, content: str) -> Message:
+        msg = Message(role="assistant", content=content)
+        self.messages.append(msg)
+        self._summary_cache = None
+        self.last_assistant = msg
+        return msg
 
     def get_context_summary(self) -> str:
+        if self._summary_cache is not None:
+            return self._summary_cache
         if not self.messages:
             return ""
         lines = ["=== Conversation History ==="]
         for i, msg in enumerate(self.messages):
             prefix = "User" if msg.role == "user" else "Claude"
-            preview = msg.content[:500] + "..." if len(msg.content) > 500 else msg.content
-            lines.append(f"[{i+1}] {prefix}: {preview}")
+            lines.append(f"[{i+1}] {prefix}: {msg.preview or msg.content}")
         lines.append("=== Current Command ===")
-        return "\n".join(lines)
+        self._summary_cache = "\n".join(lines)
+        return self._summary_cache
 
     def clear(self) -> None:
         self.messages.clear()
+        self._summary_cache = None
+        self.last_user = self.last_assistant = None
         logger.info("Conversation history cleared")
 
-    def save(self, filepath: Path) -> None:
-        try:
-            filepath.parent.mkdir(parents=True, exist_ok=True)
-            data = {"messages": [asdict(m) for m in self.messages], "saved_at": datetime.now().isoformat()}
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Failed to save history: {e}")
+    def needs_compaction(self, pending: int = 0) -> bool:
+        return self._lines_on_disk + pending > self.max_messages * self.COMPACT_FACTOR
+
+    def append(self, msgs: List[Message], filepath: Path) -> None:
+        """Persist messages as JSONL lines in a single write."""
+        with self._io_lock:
+            try:
+                filepath.parent.mkdir(parents=True, exist_ok=True)
+                data = b"".join(_dumps(m.to_dict()) + b"\n" for m in msgs)
+                if self._missing_newline:
+                    data = b"\n" + data
+                with open(filepath, 'ab') as f:
+                    f.write(data)
+                self._missing_newline = False
+                self._lines_on_disk += len(msgs)
+            except Exception as e:
+                logger.error(f"Failed to append history: {e}")
+
+    def save(self, filepath: Path, snapshot: Optional[List[Message]] = None) -> None:
+        """Rewrite the JSONL file from the in-memory window (used for /clear and compaction).
+
+        Pass a snapshot taken on the event loop when calling from a worker thread, so the
+        file matches the window at the moment the write was scheduled.
+        """
+        if snapshot is None:
+            snapshot = list(self.messages)
+        with self._io_lock:
+            try:
+                filepath.parent.mkdir(parents=True, exist_ok=True)
+                with open(filepath, 'wb') as f:
+                    f.write(b"".join(_dumps(m.to_dict()) + b"\n" for m in snapshot))
+                self._missing_newline = False
+                self._lines_on_disk = len(snapshot)
+            except Exception as e:
+                logger.error(f"Failed to save history: {e}")
 
     @classmethod
     def load(cls, filepath: Path, max_rounds: int = 10):
         history = cls(max_rounds=max_rounds)
+        legacy_file = filepath.with_suffix(".json")
         try:
             if filepath.exists():
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                for msg_data in data.get("messages", []):
-                    history.messages.append(Message(**msg_data))
+                # Keep only the raw tail lines; older ones would be evicted anyway, so skip parsing them.
+                # One spare slot, so an unterminated last line can be dropped without losing a message.
+                tail: Deque[bytes] = deque(maxlen=history.max_messages + 1)
+                line = b""
+                with open(filepath, 'rb') as f:
+                    for line in f:
+                        if line.strip():
+                            tail.append(line)
+                            history._lines_on_disk += 1
+                if line and not line.endswith(b"\n"):
+                    history._missing_newline = True
+                    if tail and tail[-1] is line:
+                        try:
+                            _loads(line)
+                        except (ValueError, TypeError):
+                            logger.warning("Dropping truncated last history line")
+                            tail.pop()
+                if len(tail) > history.max_messages:
+                    tail.popleft()
+                for line in tail:
+                    try:
+                        history.messages.append(Message.from_dict(_loads(line)))
+                    except (ValueError, TypeError):
+                        # e.g. a line cut short by an older crash, with newer records after it
+                        logger.warning("Skipping malformed history line")
                 logger.info(f"Loaded {len(history.messages)} history messages")
+            elif legacy_file.exists():
+                # One-time migration from the pre-JSONL full-document format
+                with open(legacy_file, 'rb') as f:
+                    data = _loads(f.read())
+                history.messages.extend(Message.from_dict(m) for m in data.get("messages", []))
+                history.save(filepath)
+                logger.info(f"Migrated {len(history.messages)} history messages from {legacy_file.name}")
         except Exception as e:
             logger.error(f"Failed to load history: {e}")
+        for msg in history.messages:
+            if msg.role == "user":
+                history.last_user = msg
+            elif msg.role == "assistant":
+                history.last_assistant = msg
         return history
 
 
-# === Main Bridge ===
-
-class ClaudeBridge:
-    def __init__(self):
-        self.history = ConversationHistory.load(CONFIG["HISTORY_FILE"], CONFIG["MAX_HISTORY_ROUNDS"])
-        self.is_busy = False
-        self.special_commands = {
-            "/clear": self._cmd_clear,
-            "/history": self._cmd_show_history,
-            "/help": self._cmd_help,
-            "/status": self._cmd_status,
-            "/extract": self._cmd_extract,
-            "/fetch": self._cmd_fetch,
-        }
-
-    def is_authorized(self, user_id: int) -> bool:
-        if not CONFIG["ALLOWED_USER_IDS"]:
-            return True
-        return user_id in CONFIG["ALLOWED_USER_IDS"]
+# === Static command text ===
+# Availability flags and CONFIG are fixed after import, so /help and most of /status
+# are rendered once here instead of on every call.
 
-    async def _cmd_clear(self, chat_id: int) -> str:
-        self.history.clear()
-        self.history.save(CONFIG["HISTORY_FILE"])
-        return "Conversation history cleared. New conversations will not include previous context."
+def _fmt_escape(value) -> str:
+    """Escape braces so a static value survives str.format() on the template."""
+    return str(value).replace("{", "{{").replace("}", "}}")
 
-    async def _cmd_show_history(self, chat_id: int) -> str:
-        if not self.history.messages:
-            return "No conversation history."
-        lines = [f"Conversation history ({len(self.history.messages)} messages):"]
-        for i, msg in enumerate(self.history.messages):
-            prefix = "User" if msg.role == "user" else "Claude"
-            preview = msg.content[:100] + "..." if len(msg.content) > 100 else msg.content
-            preview = preview.replace('\n', ' ')
-            lines.append(f"[{i+1}] {prefix}: {preview}")
-        return "\n".join(lines)
+def _build_help_text() -> str:
+    url_status = []
+    url_status.append(f"  fxtwitter (X/Twitter): {'✅' if HTTPX_AVAILABLE else '❌ needs httpx'}")
+    url_status.append(f"  yt-dlp (YouTube/general): {'✅' if YTDLP_AVAILABLE else '❌ not installed'}")
+    url_status.append(f"  HTTP fallback: {'✅' if HTTPX_AVAILABLE else '❌ needs httpx'}")
+    url_block = "\n".join(url_status)
 
-    async def _cmd_help(self, chat_id: int) -> str:
-        url_status = []
-        url_status.append(f"  fxtwitter (X/Twitter): {'✅' if REQUESTS_AVAILABLE else '❌ needs requests'}")
-        url_status.append(f"  yt-dlp (YouTube/general): {'✅' if YTDLP_AVAILABLE else '❌ not installed'}")
-        url_status.append(f"  HTTP fallback: {'✅' if REQUESTS_AVAILABLE else '❌ needs requests'}")
-        url_block = "\n".join(url_status)
-
-        img_enabled = CONFIG.get("IMAGE_ANALYSIS_ENABLED", False)
-        if img_enabled and GENAI_AVAILABLE:
-            img_status = f"✅ Enabled (Gemini 2.0 Flash, max {CONFIG['MAX_IMAGES_PER_MESSAGE']} images/msg)"
-        elif img_enabled:
-            img_status = "⚠️ Enabled but Gemini unavailable"
-        else:
-            img_status = "❌ Disabled"
+    img_enabled = CONFIG.get("IMAGE_ANALYSIS_ENABLED", False)
+    if img_enabled and GENAI_AVAILABLE:
+        img_status = f"✅ Enabled (Gemini 2.0 Flash, max {CONFIG['MAX_IMAGES_PER_MESSAGE']} images/msg)"
+    elif img_enabled:
+        img_status = "⚠️ Enabled but Gemini unavailable"
+    else:
+        img_status = "❌ Disabled"
 
-        return f"""Telegram Claude Bridge v2.6
+    return f"""Telegram Claude Bridge v2.6
 
 Commands:
 /clear - Clear conversation history
@@ -268,30 +409,260 @@ Log Management:
 - Auto-cleanup after {CONFIG['LOG_RETENTION_DAYS']} days
 """
 
+def _build_status_template() -> str:
+    """Status text with only {history_count}, {log_count}, {uptime} and {now} left to fill."""
+    if CONFIG.get("IMAGE_ANALYSIS_ENABLED"):
+        if GENAI_AVAILABLE:
+            img_status = f"✅ Enabled (max {CONFIG['MAX_IMAGES_PER_MESSAGE']} images/msg)"
+        else:
+            img_status = "⚠️ Enabled but Gemini unavailable"
+    else:
+        img_status = "❌ Disabled"
+
+    return f"""System Status (v2.6)
+History messages: {{history_count}}
+History file: {_fmt_escape(CONFIG['HISTORY_FILE'])}
+Max history rounds: {CONFIG['MAX_HISTORY_ROUNDS']}
+Working directory: {_fmt_escape(CONFIG['WORKING_DIR'])}
+Log directory: {_fmt_escape(CONFIG['LOG_DIR'])}
+Log files: {{log_count}}
+Log retention: {CONFIG['LOG_RETENTION_DAYS']} days
+Claude status: Ready
+
+URL Processors:
+  fxtwitter: {'✅' if HTTPX_AVAILABLE else '❌'}
+  yt-dlp: {'✅' if YTDLP_AVAILABLE else '❌'}
+  HTTP fallback: {'✅' if HTTPX_AVAILABLE else '❌'}
+
+📷 Image Analysis: {img_status}
+
+Uptime: {{uptime}}
+Current time: {{now}}
+"""
+
+def _build_welcome_template() -> str:
+    url_features = []
+    if HTTPX_AVAILABLE:
+        url_features.append("fxtwitter (X/Twitter)")
+    if YTDLP_AVAILABLE:
+        url_features.append("yt-dlp (YouTube/general)")
+    url_text = ", ".join(url_features) if url_features else "Not enabled"
+
+    img_text = "✅ Enabled" if (CONFIG.get("IMAGE_ANALYSIS_ENABLED") and GENAI_AVAILABLE) else "❌ Disabled"
+
+    return (
+        f"Telegram Claude Code Bridge v2.6\n\n"
+        f"Welcome, {{name}}!\n\n"
+        f"Features:\n"
+        f"- Auto-keep last {CONFIG['MAX_HISTORY_ROUNDS']} conversation rounds\n"
+        f"- Daily logs, auto-cleanup after {CONFIG['LOG_RETENTION_DAYS']} days\n"
+        f"- URL auto-fetch: {_fmt_escape(url_text)}\n"
+        f"- 📷 Image analysis: {img_text}\n\n"
+        f"Type /help for all commands."
+    )
+
+def _format_uptime(seconds: float) -> str:
+    minutes, sec = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}d {hours}h {minutes}m"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m {sec}s"
+
+_BOOT_MONOTONIC = time.monotonic()
+_HELP_TEXT = _build_help_text()
+_STATUS_TEMPLATE = _build_status_template()
+_WELCOME_TEMPLATE = _build_welcome_template()
+
+
+# === Main Bridge ===
+
+# Keep Windows from allocating a console window for each Claude subprocess
+_NO_WINDOW = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+def _kill_process_tree(process) -> None:
+    """Kill a subprocess started with start_new_session, including its children on POSIX."""
+    if process.returncode is not None:
+        return
+    try:
+        if sys.platform != "win32":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _match_command(text: str, commands) -> Optional[str]:
+    """Return the command that ``text`` starts with (case-insensitive, whole word), or None.
+
+    Only a short lowered head of the message is inspected, so long prompts are never
+    tokenized or copied just to route them.
+    """
+    head = text.lstrip()[:16].lower()
+    if not head.startswith("/"):
+        return None
+    for cmd in commands:
+        if head.startswith(cmd) and (len(head) == len(cmd) or head[len(cmd)].isspace()):
+            return cmd
+    return None
+
+
+def _strip_tokens(text: str, tokens) -> str:
+    """Remove every occurrence of any of ``tokens`` from text in one regex pass, then strip."""
+    # Longest first, so a URL is never left half-removed by a shorter token inside it
+    pattern = "|".join(re.escape(t) for t in sorted(set(tokens), key=len, reverse=True))
+    return re.sub(pattern, "", text).strip() if pattern else text.strip()
+
+
+# Receives each decoded piece of Claude's stdout as it streams in
+OutputCallback = Callable[[str], Awaitable[None]]
+
+# Queued in place of a Message to ask the saver for a full history rewrite (/clear)
+_HISTORY_REWRITE = object()
+
+# Backoff (seconds) before replacing a prewarmed process that exited on its own
+_SPARE_RESPAWN_MIN = 1
+_SPARE_RESPAWN_MAX = 300
+
+# /history shows each message on one line
+_ONE_LINE_TABLE = str.maketrans({'\n': ' ', '\r': ' '})
+
+# Seconds a /status log-file count stays valid
+_LOG_COUNT_TTL = 30
+
+_ANSI_ESCAPE_RE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+# Fixed prompt fragments, encoded once; ALLOW_DANGEROUS cannot change after startup
+_PROMPT_SAFETY_BLOCK = b"\n\n" + (
+    b"" if CONFIG["ALLOW_DANGEROUS"] else b"Safety: Do not delete important files or modify system settings."
+)
+_PROMPT_RESPOND_SUFFIX = b"\nRespond based on the conversation context above."
+
+# Replies are cut to this many characters before being sent to Telegram
+_MAX_REPLY_CHARS = 3500
+# ANSI stripping looks at no more than this many characters of a reply
+_ANSI_SCAN_CHARS = 4096
+# Stop decoding Claude's stdout once this many characters have arrived; nothing past the
+# ANSI scan window can reach the reply, so the rest is drained but neither decoded nor kept
+_STDOUT_CHAR_CAP = _ANSI_SCAN_CHARS
+
+class ClaudeBridge:
+    def __init__(self):
+        self.history = ConversationHistory.load(CONFIG["HISTORY_FILE"], CONFIG["MAX_HISTORY_ROUNDS"])
+        # Cap on URL fetches in flight (the links of one message are fetched concurrently)
+        self._fetch_sem = asyncio.Semaphore(CONFIG["URL_FETCH_CONCURRENCY"])
+        # Dedicated pool for blocking disk writes so bursts can't grow the default executor
+        self._executor = ThreadPoolExecutor(
+            max_workers=CONFIG["BRIDGE_IO_THREADS"], thread_name_prefix="bridge-io"
+        )
+        atexit.register(self._executor.shutdown, wait=True)
+        # /extract blocks on a Gemini round trip (seconds); keep it off the disk pool so it
+        # can never delay history saves. Network-bound, so threads (not processes) suffice.
+        self._api_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bridge-api")
+        atexit.register(self._api_executor.shutdown, wait=False)
+        # Messages waiting to be persisted, drained by _saver_loop(); _HISTORY_REWRITE requests a full rewrite
+        self._save_queue: asyncio.Queue = asyncio.Queue()
+        # Idle pre-spawned Claude process (see _acquire_claude)
+        self._spare = None
+        # Long-lived task that spawns and watches the spare; set _spare_wanted to request one
+        self._spare_task: Optional[asyncio.Task] = None
+        self._spare_wanted = asyncio.Event()
+        # Set by close(); no new spare may be spawned (or kept) once shutdown has begun
+        self._closing = False
+        # (count, monotonic time counted) for /status; see _LOG_COUNT_TTL
+        self._log_count_cache: Tuple[int, float] = (0, float("-inf"))
+        self._respawn_delay = _SPARE_RESPAWN_MIN
+        self.special_commands = {
+            "/clear": self._cmd_clear,
+            "/history": self._cmd_show_history,
+            "/help": self._cmd_help,
+            "/status": self._cmd_status,
+            "/extract": self._cmd_extract,
+            "/fetch": self._cmd_fetch,
+        }
+
+    def is_authorized(self, user_id: int) -> bool:
+        if not CONFIG["ALLOWED_USER_IDS"]:
+            return True
+        return user_id in CONFIG["ALLOWED_USER_IDS"]
+
+    async def _saver_loop(self):
+        """Persist queued history writes off the event loop, coalescing whatever has piled up."""
+        loop = asyncio.get_running_loop()
+        history_file = CONFIG["HISTORY_FILE"]
+        delay = CONFIG["HISTORY_SAVE_DELAY"]
+        while True:
+            batch = [await self._save_queue.get()]
+            if delay > 0:
+                # Debounce: a turn's user and assistant lines (and any burst) land in one write
+                await asyncio.sleep(delay)
+            while not self._save_queue.empty():
+                batch.append(self._save_queue.get_nowait())
+            msgs = [m for m in batch if m is not _HISTORY_REWRITE]
+            try:
+                if len(msgs) < len(batch) or self.history.needs_compaction(len(msgs)):
+                    # Every queued message not cleared since is already in the window
+                    snapshot = list(self.history.messages)
+                    await loop.run_in_executor(self._executor, self.history.save, history_file, snapshot)
+                else:
+                    await loop.run_in_executor(self._executor, self.history.append, msgs, history_file)
+            except Exception as e:
+                logger.error(f"History saver error: {e}")
+            finally:
+                for _ in batch:
+                    self._save_queue.task_done()
+
+    async def flush_history(self, timeout: float = 10) -> None:
+        """Wait until every queued history write has reached disk."""
+        try:
+            await asyncio.wait_for(self._save_queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out flushing conversation history")
+
+    async def _cmd_clear(self, chat_id: int) -> str:
+        self.history.clear()
+        self._save_queue.put_nowait(_HISTORY_REWRITE)
+        return "Conversation history cleared. New conversations will not include previous context."
+
+    async def _cmd_show_history(self, chat_id: int) -> str:
+        if not self.history.messages:
+            return "No conversation history."
+        lines = [f"Conversation history ({len(self.history.messages)} messages):"]
+        for i, msg in enumerate(self.history.messages):
+            prefix = "User" if msg.role == "user" else "Claude"
+            content = msg.content
+            preview = (content[:100] + "..." if len(content) > 100 else content).translate(_ONE_LINE_TABLE)
+            lines.append(f"[{i+1}] {prefix}: {preview}")
+        return "\n".join(lines)
+
+    async def _cmd_help(self, chat_id: int) -> str:
+        return _HELP_TEXT
+
     async def _cmd_fetch(self, chat_id: int) -> str:
         if not self.history.messages:
             return "No messages. Usage: /fetch <URL> [notes]"
-        last_user = None
-        for msg in reversed(self.history.messages):
-            if msg.role == "user":
-                last_user = msg.content
-                break
-        if not last_user:
+        if self.history.last_user is None:
             return "No user message found."
+        last_user = self.history.last_user.content
         urls = detect_urls(last_user)
         if not urls:
             return "No URL found in last message."
-        url = urls[0][0]
-        user_note = last_user.replace(url, "").replace("/fetch", "").strip()
-        enhanced_text, summaries = await preprocess_urls(url, config=CONFIG)
-        fetched = enhanced_text if enhanced_text != url else "Could not fetch"
+        # Every link in the message is fetched (concurrently, inside preprocess_urls)
+        url_list = [u for u, _ in urls]
+        url_text = " ".join(url_list)
+        user_note = _strip_tokens(last_user, url_list + ["/fetch"])
+        enhanced_text, _, _ = await preprocess_urls(url_text, config=CONFIG, semaphore=self._fetch_sem)
+        fetched = enhanced_text if enhanced_text != url_text else "Could not fetch"
         fetch_prompt = "URL content:" + chr(10) + fetched + chr(10) + chr(10)
         if user_note:
             fetch_prompt += "User task: " + user_note + chr(10) + chr(10)
         fetch_prompt += "Provide comprehensive analysis. Structure clearly."
         response = await self.execute_claude(fetch_prompt)
-        saved = await asyncio.get_event_loop().run_in_executor(
-            None, save_fetch_output, url, fetched, response, user_note, CONFIG
+        saved = await asyncio.get_running_loop().run_in_executor(
+            self._executor, save_fetch_output, url_list[0], fetched, response, user_note, CONFIG, url_list[1:]
         )
         if saved:
             return response + chr(10) + chr(10) + "---" + chr(10) + "Saved: " + saved
@@ -300,130 +671,263 @@ Log Management:
     async def _cmd_extract(self, chat_id: int) -> str:
         if not self.history.messages:
             return "No history to extract."
-        last_assistant = None
-        for msg in reversed(self.history.messages):
-            if msg.role == "assistant":
-                last_assistant = msg.content
-                break
-        if not last_assistant:
+        if self.history.last_assistant is None:
             return "No assistant reply found."
-        result = await asyncio.get_event_loop().run_in_executor(None, extract_structured_data, last_assistant)
+        last_assistant = self.history.last_assistant.content
+        result = await asyncio.get_running_loop().run_in_executor(self._api_executor, extract_structured_data, last_assistant)
         return result or "No extraction result"
 
     async def _cmd_status(self, chat_id: int) -> str:
-        log_files = list(CONFIG["LOG_DIR"].glob("bridge.log*"))
-        status = "Busy" if self.is_busy else "Ready"
-
-        if CONFIG.get("IMAGE_ANALYSIS_ENABLED"):
-            if GENAI_AVAILABLE:
-                img_status = f"✅ Enabled (max {CONFIG['MAX_IMAGES_PER_MESSAGE']} images/msg)"
-            else:
-                img_status = "⚠️ Enabled but Gemini unavailable"
-        else:
-            img_status = "❌ Disabled"
-
-        return f"""System Status (v2.6)
-History messages: {len(self.history.messages)}
-History file: {CONFIG['HISTORY_FILE']}
-Max history rounds: {CONFIG['MAX_HISTORY_ROUNDS']}
-Working directory: {CONFIG['WORKING_DIR']}
-Log directory: {CONFIG['LOG_DIR']}
-Log files: {len(log_files)}
-Log retention: {CONFIG['LOG_RETENTION_DAYS']} days
-Claude status: {status}
+        # Log files change at most once a day; don't rescan the directory on every /status
+        now = time.monotonic()
+        log_count, counted_at = self._log_count_cache
+        if now - counted_at > _LOG_COUNT_TTL:
+            with os.scandir(CONFIG["LOG_DIR"]) as it:
+                log_count = sum(1 for e in it if e.name.startswith("bridge.log"))
+            self._log_count_cache = (log_count, now)
+        return _STATUS_TEMPLATE.format(
+            history_count=len(self.history.messages),
+            log_count=log_count,
+            uptime=_format_uptime(time.monotonic() - _BOOT_MONOTONIC),
+            now=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        )
 
-URL Processors:
-  fxtwitter: {'✅' if REQUESTS_AVAILABLE else '❌'}
-  yt-dlp: {'✅' if YTDLP_AVAILABLE else '❌'}
-  HTTP fallback: {'✅' if REQUESTS_AVAILABLE else '❌'}
+    def _build_prompt_with_context(self, user_message: str) -> bytes:
+        """Assemble the stdin payload for Claude, already UTF-8 encoded."""
+        if not self.history.messages:
+            return user_message.encode('utf-8') + _PROMPT_SAFETY_BLOCK
+        return b"".join((
+            self.history.get_context_summary().encode('utf-8'), b"\n", user_message.encode('utf-8'),
+            _PROMPT_SAFETY_BLOCK, _PROMPT_RESPOND_SUFFIX,
+        ))
+
+    async def _spawn_claude(self):
+        return await asyncio.create_subprocess_exec(
+            CONFIG["CLAUDE_CLI"], "--print", "--dangerously-skip-permissions",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=str(CONFIG["WORKING_DIR"]),
+            # Own process group, so an early kill also reaps tool subprocesses holding the pipes
+            start_new_session=(sys.platform != "win32"),
+            creationflags=_NO_WINDOW,
+        )
 
-📷 Image Analysis: {img_status}
+    async def _acquire_claude(self):
+        """Hand out the prewarmed process if it is still alive, else spawn one.
 
-Current time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-"""
+        `claude --print` only reads its prompt once stdin is written, so a spare spawned
+        ahead of time has already paid process creation and CLI startup. The next spare
+        is requested by execute_claude() once this run has finished.
+        """
+        process, self._spare = self._spare, None
+        if process is None or process.returncode is not None:
+            process = await self._spawn_claude()
+        else:
+            self._respawn_delay = _SPARE_RESPAWN_MIN
+        return process
 
-    def _build_prompt_with_context(self, user_message: str) -> str:
-        context = self.history.get_context_summary()
-        safety_note = "Safety: Do not delete important files or modify system settings." if not CONFIG["ALLOW_DANGEROUS"] else ""
-        if context:
-            return f"{context}\n{user_message}\n\n{safety_note}\nRespond based on the conversation context above."
-        return f"{user_message}\n\n{safety_note}"
-
-    async def execute_claude(self, prompt: str) -> str:
-        if self.is_busy:
-            return "Claude is processing another task, please wait..."
-        self.is_busy = True
+    async def _spawn_spare(self):
+        """_spawn_claude() that never leaks a process when the awaiting task is cancelled."""
+        spawn = asyncio.ensure_future(self._spawn_claude())
         try:
-            full_prompt = self._build_prompt_with_context(prompt)
-            logger.info(f"Executing Claude: {prompt[:100]}...")
-            process = await asyncio.create_subprocess_shell(
-                f'"{CONFIG["CLAUDE_CLI"]}" --print --dangerously-skip-permissions',
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=str(CONFIG["WORKING_DIR"])
-            )
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(input=full_prompt.encode('utf-8')),
-                timeout=CONFIG["TIMEOUT"]
+            return await asyncio.shield(spawn)
+        except asyncio.CancelledError:
+            # Cancelled mid-spawn (shutdown): let the spawn finish so the new process is
+            # killed here instead of outliving the bot in its own session
+            try:
+                _kill_process_tree(await spawn)
+            except Exception:
+                pass
+            raise
+
+    def start_prewarm(self) -> None:
+        """Ask for an idle spare, starting the supervisor task on first use."""
+        if self._closing:
+            return
+        if self._spare_task is None or self._spare_task.done():
+            self._spare_task = asyncio.create_task(self._supervise_spare())
+        self._spare_wanted.set()
+
+    async def _supervise_spare(self) -> None:
+        """Keep one idle Claude process ready; the only task that ever spawns a spare.
+
+        Respawns the spare if it dies while idle, backing off if the CLI keeps exiting.
+        close() cancels this one task, which is safe even mid-spawn (see _spawn_spare).
+        """
+        while not self._closing:
+            await self._spare_wanted.wait()
+            self._spare_wanted.clear()
+            process = self._spare
+            if process is None or process.returncode is not None:
+                try:
+                    process = await self._spawn_spare()
+                except Exception as e:
+                    logger.warning(f"Claude prewarm failed: {e}")
+                    continue
+                self._spare = process
+
+            # Wake when the spare exits, or when the next one is requested
+            exited = asyncio.ensure_future(process.wait())
+            wanted = asyncio.ensure_future(self._spare_wanted.wait())
+            try:
+                await asyncio.wait((exited, wanted), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                exited.cancel()
+                wanted.cancel()
+            if self._spare is not process or not exited.done():
+                continue  # handed out (it exited, or the next spare was requested), or a request while idle
+
+            self._spare = None
+            delay = self._respawn_delay
+            self._respawn_delay = min(delay * 2, _SPARE_RESPAWN_MAX)
+            logger.warning("Prewarmed Claude process exited (code %s); respawning in %ss",
+                           process.returncode, delay)
+            await asyncio.sleep(delay)
+            self._spare_wanted.set()
+
+    async def close(self) -> None:
+        """Stop the spare supervisor and kill the idle spare process, if any (called on shutdown)."""
+        self._closing = True
+        # Cancelling mid-spawn is safe: _spawn_spare() kills the process it was creating
+        if self._spare_task is not None:
+            self._spare_task.cancel()
+            await asyncio.gather(self._spare_task, return_exceptions=True)
+        if self._spare is not None:
+            _kill_process_tree(self._spare)
+            self._spare = None
+
+    async def execute_claude(self, prompt: str, on_output: Optional[OutputCallback] = None) -> str:
+        """Run Claude on prompt plus history context and return the formatted reply.
+
+        on_output receives stdout text as it streams in; it is awaited inline, so it
+        should be cheap (throttle any Telegram edits on the caller side).
+        """
+        full_prompt = self._build_prompt_with_context(prompt)
+        timeout = CONFIG["TIMEOUT"]
+        process = None
+        try:
+            logger.info("Executing Claude: %.100s...", prompt)
+            process = await self._acquire_claude()
+            output, stderr, truncated = await asyncio.wait_for(
+                self._read_capped(process, full_prompt, on_output),
+                timeout=timeout
             )
-            output = stdout.decode('utf-8', errors='replace')
-            error = stderr.decode('utf-8', errors='replace')
-            if error and not output:
-                result = f"Error:\n{error}"
+            if not output and stderr:
+                # stderr is only decoded when it is what the user will see
+                result = f"Error:\n{stderr.decode('utf-8', errors='replace')}"
             elif output:
-                result = self._format_output(output)
+                result = self._format_output(output, truncated)
             else:
                 result = "Task completed (no output)"
             return result
         except asyncio.TimeoutError:
-            return f"Execution timeout ({CONFIG['TIMEOUT']}s)"
+            if process is not None:
+                _kill_process_tree(process)
+            return f"Execution timeout ({timeout}s)"
         except FileNotFoundError:
             return "Claude CLI not found. Please ensure Claude Code is installed."
         except Exception as e:
             logger.error(f"Claude execution error: {e}")
             return f"Execution error: {str(e)}"
         finally:
-            self.is_busy = False
-
-    def _format_output(self, output: str) -> str:
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        output = ansi_escape.sub('', output)
-        if len(output) > 3500:
-            output = output[:3500] + "\n\n...(output truncated)"
+            # Warm the next process only now: a spare started during the run would double the
+            # CLIs running and read WORKING_DIR config before this turn's edits land
+            if CONFIG["CLAUDE_PREWARM"]:
+                self.start_prewarm()
+
+    @staticmethod
+    async def _read_capped(process, data: bytes, on_output: Optional[OutputCallback] = None
+                           ) -> Tuple[str, bytes, bool]:
+        """Feed stdin and collect stdout up to _STDOUT_CHAR_CAP characters.
+
+        stdout is decoded incrementally as it arrives; each decoded piece is also passed to
+        on_output (if given), so callers can show progress before the process exits.
+        Past the cap the rest of stdout is still read to EOF and discarded: Claude may be
+        mid-way through a tool call (file write, git...), so it is never killed for being
+        verbose. stderr is drained concurrently so a chatty process can't block on a full pipe.
+        Returns (stdout_text, stderr, truncated).
+        """
+        async def feed():
+            try:
+                process.stdin.write(data)
+                await process.stdin.drain()
+                process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # process exited (or was killed) before reading all input
+
+        feeder = asyncio.create_task(feed())
+        err_reader = asyncio.create_task(process.stderr.read())
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        pieces, chars, truncated = [], 0, False
+        try:
+            while chunk := await process.stdout.read(65536):
+                if truncated:
+                    continue  # drain only, so the process can run to completion
+                text = decoder.decode(chunk)
+                if text:
+                    pieces.append(text)
+                    chars += len(text)
+                    if on_output is not None:
+                        try:
+                            await on_output(text)
+                        except Exception as e:
+                            logger.warning(f"Output callback failed: {e}")
+                if chars > _STDOUT_CHAR_CAP:
+                    truncated = True
+            if not truncated:
+                pieces.append(decoder.decode(b"", final=True))
+            await feeder
+            stderr = await err_reader
+            await process.wait()
+        finally:
+            feeder.cancel()
+            err_reader.cancel()
+        return "".join(pieces), stderr, truncated
+
+    def _format_output(self, output: str, truncated: bool = False) -> str:
+        # Most replies carry no escape codes at all; a substring check skips the regex scan
+        if '\x1b' in output:
+            # Only scan what can survive the final clip, plus a margin for the codes removed
+            if len(output) > _ANSI_SCAN_CHARS:
+                output = output[:_ANSI_SCAN_CHARS]
+                truncated = True
+            output = _ANSI_ESCAPE_RE.sub('', output)
+        if len(output) > _MAX_REPLY_CHARS:
+            output = output[:_MAX_REPLY_CHARS] + "\n\n...(output truncated)"
+        elif truncated:
+            output += "\n\n...(output truncated)"
         return output
 
-    async def handle_message(self, chat_id: int, text: str) -> Tuple[str, Optional[str]]:
-        text = text.strip()
-        cmd = text.split()[0].lower() if text else ""
-        if cmd in self.special_commands:
-            logger.info(f"Command received (chat_id={chat_id}): {cmd}")
-            return await self.special_commands[cmd](chat_id), None
+    async def handle_message(self, chat_id: int, text: str,
+                             on_output: Optional[OutputCallback] = None) -> Tuple[str, Optional[str]]:
+        """Run a chat message through URL preprocessing and Claude.
 
-        logger.info(f"Message received (chat_id={chat_id}): {text[:100]}...")
+        Special commands never get here: message_handler dispatches them to special_commands.
+        """
+        text = text.strip()
+        logger.info("Message received (chat_id=%s): %.100s...", chat_id, text)
 
         # URL preprocessing
-        enhanced_text, url_summaries = await preprocess_urls(text, config=CONFIG)
+        enhanced_text, url_summaries, detected = await preprocess_urls(text, config=CONFIG, semaphore=self._fetch_sem)
 
         url_status = None
         if url_summaries:
             url_status = "🔗 URL processing:\n" + "\n".join(url_summaries)
-            logger.info(f"URL preprocessing done: {url_summaries}")
+            logger.info("URL preprocessing done: %s", url_summaries)
 
-        self.history.add_user_message(text)
-        response = await self.execute_claude(enhanced_text)
+        loop = asyncio.get_running_loop()
+        self._save_queue.put_nowait(self.history.add_user_message(text))
+        response = await self.execute_claude(enhanced_text, on_output=on_output)
+        self._save_queue.put_nowait(self.history.add_assistant_message(response))
 
         # Auto-save fetch output when URLs present
-        if url_summaries:
-            detected = detect_urls(text)
-            if detected:
-                fetch_url = detected[0][0]
-                user_note = text.replace(fetch_url, "").strip()
-                await asyncio.get_event_loop().run_in_executor(
-                    None, save_fetch_output, fetch_url, enhanced_text, response, user_note, CONFIG
-                )
-        self.history.add_assistant_message(response)
-        self.history.save(CONFIG["HISTORY_FILE"])
+        if url_summaries and detected:
+            fetch_url = detected[0][0]
+            user_note = text.replace(fetch_url, "").strip()
+            await loop.run_in_executor(
+                self._executor, save_fetch_output, fetch_url, enhanced_text, response, user_note, CONFIG
+            )
 
         return response, url_status
 
@@ -432,31 +936,83 @@ Current time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 bridge = None
 
+# Telegram caps messages at 4096 chars; leave room for the "[i/n]" / "Claude:" header
+TELEGRAM_MAX_MSG = 4096 - 32
+
+def _chunk_bounds(text: str, limit: int = TELEGRAM_MAX_MSG):
+    """Yield (start, end) offsets of <= limit pieces, breaking on a newline when one is near the end."""
+    start, n = 0, len(text)
+    while start < n:
+        end = min(start + limit, n)
+        if end < n:
+            nl = text.rfind("\n", start + limit // 2, end)
+            if nl != -1:
+                end = nl + 1
+        yield start, end
+        start = end
+
+def _reply_pieces(result: str, url_status: Optional[str] = None):
+    """Yield the Telegram messages for one reply; each chunk is sliced only when it is about to be sent."""
+    reply = f"Claude:\n\n{result}"
+    if url_status and len(url_status) + len(reply) + 7 <= TELEGRAM_MAX_MSG:
+        yield f"{url_status}\n\n---\n\n{reply}"
+        return
+    if url_status:
+        yield url_status
+    if len(result) <= TELEGRAM_MAX_MSG:
+        yield reply
+        return
+    # Only the offsets are materialized, to know the piece count up front
+    bounds = list(_chunk_bounds(result))
+    for i, (start, end) in enumerate(bounds):
+        yield f"[{i+1}/{len(bounds)}]\n\n{result[start:end]}"
+
+class _StreamPreview:
+    """on_output callback that mirrors Claude's partial output into the processing message.
+
+    Edits are throttled to one per STREAM_EDIT_INTERVAL and run as a background task,
+    so a slow Telegram round trip never stalls reading Claude's stdout.
+    """
+
+    __slots__ = ("_message", "_interval", "_parts", "_last_edit", "_task")
+
+    def __init__(self, message, interval: float):
+        self._message = message
+        self._interval = interval
+        self._parts: List[str] = []
+        self._last_edit = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    async def __call__(self, text: str) -> None:
+        self._parts.append(text)
+        now = time.monotonic()
+        if now - self._last_edit < self._interval or (self._task is not None and not self._task.done()):
+            return
+        self._last_edit = now
+        partial = "".join(self._parts)
+        if '\x1b' in partial:
+            partial = _ANSI_ESCAPE_RE.sub('', partial)
+        self._task = asyncio.create_task(self._edit(f"Claude is writing...\n\n{partial[-_MAX_REPLY_CHARS:]}"))
+
+    async def _edit(self, text: str) -> None:
+        try:
+            await self._message.edit_text(text)
+        except Exception as e:
+            # "Message is not modified", flood control, ...: the preview is best effort
+            logger.debug("Stream preview edit failed: %s", e)
+
+    async def finish(self) -> None:
+        """Wait for an in-flight edit so it can't land after (and overwrite) the final reply."""
+        if self._task is not None:
+            await self._task
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not bridge.is_authorized(user.id):
         await update.message.reply_text(f"Unauthorized user\nYour User ID: {user.id}")
         return
 
-    url_features = []
-    if REQUESTS_AVAILABLE:
-        url_features.append("fxtwitter (X/Twitter)")
-    if YTDLP_AVAILABLE:
-        url_features.append("yt-dlp (YouTube/general)")
-    url_text = ", ".join(url_features) if url_features else "Not enabled"
-
-    img_text = "✅ Enabled" if (CONFIG.get("IMAGE_ANALYSIS_ENABLED") and GENAI_AVAILABLE) else "❌ Disabled"
-
-    await update.message.reply_text(
-        f"Telegram Claude Code Bridge v2.6\n\n"
-        f"Welcome, {user.first_name}!\n\n"
-        f"Features:\n"
-        f"- Auto-keep last {CONFIG['MAX_HISTORY_ROUNDS']} conversation rounds\n"
-        f"- Daily logs, auto-cleanup after {CONFIG['LOG_RETENTION_DAYS']} days\n"
-        f"- URL auto-fetch: {url_text}\n"
-        f"- 📷 Image analysis: {img_text}\n\n"
-        f"Type /help for all commands."
-    )
+    await update.message.reply_text(_WELCOME_TEMPLATE.format(name=user.first_name))
 
 async def exec_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not bridge.is_authorized(update.effective_user.id):
@@ -468,7 +1024,8 @@ async def exec_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     command = ' '.join(context.args)
     await update.message.reply_text(f"Executing: {command}")
     try:
-        # Cross-platform: use shell=True so it works on both Windows and Linux
+        # /exec is a shell command runner: builtins (cd, type, ulimit...) and shell syntax
+        # need shell=True, on both Windows and Linux
         result = subprocess.run(
             command, shell=True,
             capture_output=True, text=True, timeout=60,
@@ -490,13 +1047,16 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Unauthorized\nYour User ID: {user_id}")
         return
 
-    text = update.message.text
+    text = update.message.text.strip()
+    if not text:
+        return
 
-    # Special commands (/clear /help etc.) — fast response, no processing message
-    cmd = text.strip().split()[0].lower() if text.strip() else ""
-    if cmd in bridge.special_commands:
-        result, _ = await bridge.handle_message(update.effective_chat.id, text)
-        await update.message.reply_text(result)
+    # Special commands (/clear /help etc.) — fast response, no processing message,
+    # dispatched directly so the command is matched only once
+    cmd = _match_command(text, bridge.special_commands)
+    if cmd:
+        logger.info("Command received (chat_id=%s): %s", update.effective_chat.id, cmd)
+        await update.message.reply_text(await bridge.special_commands[cmd](update.effective_chat.id))
         return
 
     urls = detect_urls(text)
@@ -509,41 +1069,91 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Claude is processing...\n{text[:50]}{'...' if len(text) > 50 else ''}"
         )
 
-    result, url_status = await bridge.handle_message(update.effective_chat.id, text)
+    preview = None
+    if CONFIG["STREAM_EDIT_INTERVAL"] > 0:
+        preview = _StreamPreview(processing_msg, CONFIG["STREAM_EDIT_INTERVAL"])
+    result, url_status = await bridge.handle_message(update.effective_chat.id, text, on_output=preview)
+    if preview is not None:
+        await preview.finish()
 
+    # Reuse the processing message for the first piece: one edit instead of delete + send
+    pieces = _reply_pieces(result, url_status)
+    first = next(pieces)
     try:
-        await processing_msg.delete()
-    except:
-        pass
-
-    if url_status:
-        await update.message.reply_text(url_status)
-
-    if len(result) > 4000:
-        chunks = [result[i:i+4000] for i in range(0, len(result), 4000)]
-        for i, chunk in enumerate(chunks):
-            await update.message.reply_text(f"[{i+1}/{len(chunks)}]\n\n{chunk}")
-    else:
-        await update.message.reply_text(f"Claude:\n\n{result}")
+        await processing_msg.edit_text(first)
+    except Exception:
+        await update.message.reply_text(first)
+    # In order, one at a time: Telegram shows messages in arrival order
+    for piece in pieces:
+        await update.message.reply_text(piece)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Error: {context.error}")
     if update and update.message:
         await update.message.reply_text("An error occurred, please check logs")
 
+_background_tasks = []
+
+async def post_init(application):
+    _background_tasks.append(asyncio.create_task(bridge._saver_loop()))
+    if CONFIG["CLAUDE_PREWARM"]:
+        bridge.start_prewarm()
+
+async def post_shutdown(application):
+    await bridge.flush_history()
+    await bridge.close()
+    await close_http_client()
+    for task in _background_tasks:
+        task.cancel()
+
+CLAUDE_CLI_CACHE = BASE_DIR / ".claude_cli_cache.json"
+
+def _cli_fingerprint(path: str) -> Optional[Tuple[str, float]]:
+    """(resolved file, mtime) for a CLI name or path, or None if it can't be found."""
+    resolved = shutil.which(path)
+    if not resolved:
+        return None
+    try:
+        return resolved, os.path.getmtime(resolved)
+    except OSError:
+        return None
+
 def find_claude_cli():
     paths = [CONFIG["CLAUDE_CLI"], "claude"]
     # Windows-specific paths
     if sys.platform == "win32":
         paths.append(os.path.expandvars(r"%APPDATA%\npm\claude.cmd"))
+
+    # Reuse last start's result while the binary it resolved to is unchanged (skips --version spawns)
+    try:
+        cached = json.loads(CLAUDE_CLI_CACHE.read_text(encoding='utf-8'))
+        if cached["path"] in paths and _cli_fingerprint(cached["path"]) == (cached["resolved"], cached["mtime"]):
+            logger.info(f"Found Claude CLI (cached): {cached['resolved']}")
+            return cached["resolved"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # missing or corrupt cache: fall through to the full probe
+
     for path in paths:
+        # Resolve through PATH/PATHEXT ourselves so the probe (and every later run) can be
+        # exec'd directly instead of going through a shell
+        fingerprint = _cli_fingerprint(path)
+        if not fingerprint:
+            continue
+        resolved = fingerprint[0]
         try:
-            result = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=10, shell=True)
-            if result.returncode == 0:
-                logger.info(f"Found Claude CLI: {path}")
-                return path
-        except:
+            result = subprocess.run([resolved, "--version"], capture_output=True, text=True,
+                                    timeout=10, creationflags=_NO_WINDOW)
+        except (OSError, subprocess.SubprocessError):
             continue
+        if result.returncode == 0:
+            logger.info(f"Found Claude CLI: {resolved}")
+            try:
+                CLAUDE_CLI_CACHE.write_text(json.dumps(
+                    {"path": path, "resolved": resolved, "mtime": fingerprint[1]}
+                ), encoding='utf-8')
+            except OSError as e:
+                logger.warning(f"Could not write {CLAUDE_CLI_CACHE.name}: {e}")
+            return resolved
     return None
 
 def main():
@@ -572,13 +1182,23 @@ def main():
         print("Error: Claude CLI not found. Please install: npm install -g @anthropic-ai/claude-code")
         return
 
+    # Before anything creates a loop; Windows keeps the default Proactor loop (needed for subprocesses)
+    if UVLOOP_AVAILABLE:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     bridge = ClaudeBridge()
 
-    application = Application.builder().token(CONFIG["TELEGRAM_BOT_TOKEN"]).build()
+    # Updates are processed one at a time (concurrent_updates is off), so Claude turns on the
+    # shared history never overlap; the links within one message are still fetched concurrently
+    application = (
+        Application.builder().token(CONFIG["TELEGRAM_BOT_TOKEN"])
+        .post_init(post_init).post_shutdown(post_shutdown)
+        .build()
+    )
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("exec", exec_command))
     # Do NOT use ~filters.COMMAND: /clear /help /history /status /extract /fetch
-    # must enter message_handler for bridge.handle_message() internal routing.
+    # must enter message_handler, which routes them to bridge.special_commands.
     # /start and /exec are already caught by CommandHandler above (takes priority).
     application.add_handler(MessageHandler(filters.TEXT, message_handler))
     application.add_error_handler(error_handler)
@@ -586,7 +1206,8 @@ def main():
     logger.info(f"History messages: {len(bridge.history.messages)}")
     logger.info(f"Max history rounds: {CONFIG['MAX_HISTORY_ROUNDS']}")
     logger.info(f"Log directory: {CONFIG['LOG_DIR']}")
-    logger.info(f"URL processors: fxtwitter={'✅' if REQUESTS_AVAILABLE else '❌'}, yt-dlp={'✅' if YTDLP_AVAILABLE else '❌'}")
+    logger.info(f"Event loop: {'uvloop' if UVLOOP_AVAILABLE else 'asyncio'}")
+    logger.info(f"URL processors: fxtwitter={'✅' if HTTPX_AVAILABLE else '❌'}, yt-dlp={'✅' if YTDLP_AVAILABLE else '❌'}")
     img_flag = "✅" if (CONFIG.get("IMAGE_ANALYSIS_ENABLED") and GENAI_AVAILABLE) else "❌"
     logger.info(f"Image analysis: {img_flag} (Gemini={'✅' if GENAI_AVAILABLE else '❌'}, enabled={CONFIG.get('IMAGE_ANALYSIS_ENABLED')})")
     logger.info("Bot started, waiting for Telegram messages...")
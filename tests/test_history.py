@@ -0,0 +1,18 @@
+from telegram_bridge_claude import ConversationHistory, Message
+
+
+def test_append_after_truncated_tail(tmp_path):
+    path = tmp_path / "conversation_history.jsonl"
+    history = ConversationHistory(max_rounds=1)
+    history.append([Message("user", "first")], path)
+    # Simulate a crash part-way through writing the next record
+    with open(path, "ab") as f:
+        f.write(b'{"role": "assistant", "cont')
+
+    history = ConversationHistory.load(path, max_rounds=1)
+    assert [m.content for m in history.messages] == ["first"]
+
+    history.append([Message("user", "second"), Message("assistant", "reply")], path)
+    reloaded = ConversationHistory.load(path, max_rounds=1)
+    assert [m.content for m in reloaded.messages] == ["second", "reply"]
+    assert path.read_bytes().endswith(b"\n")
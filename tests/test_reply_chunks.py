@@ -0,0 +1,43 @@
+from telegram_bridge_claude import TELEGRAM_MAX_MSG, _chunk_bounds, _reply_pieces
+
+TELEGRAM_LIMIT = 4096
+
+
+def test_chunk_prefers_newline_in_second_half():
+    text = "a" * 70 + "\n" + "b" * 50
+    assert list(_chunk_bounds(text, limit=100)) == [(0, 71), (71, 121)]
+
+
+def test_chunk_hard_cuts_without_nearby_newline():
+    # The only newline sits in the first half of the window, so it is ignored
+    text = "a" * 10 + "\n" + "b" * 200
+    bounds = list(_chunk_bounds(text, limit=100))
+    assert bounds == [(0, 100), (100, 200), (200, 211)]
+
+
+def test_chunks_cover_text_exactly():
+    text = ("line of text\n" * 700) + "x" * 5000
+    bounds = list(_chunk_bounds(text))
+    assert "".join(text[s:e] for s, e in bounds) == text
+    assert all(e - s <= TELEGRAM_MAX_MSG for s, e in bounds)
+
+
+def test_short_reply_is_combined_with_url_status():
+    assert list(_reply_pieces("hi", "🔗 URL processing:\nok")) == [
+        "🔗 URL processing:\nok\n\n---\n\nClaude:\n\nhi"
+    ]
+
+
+def test_long_reply_pieces_carry_header_and_fit():
+    result = "x" * (TELEGRAM_MAX_MSG * 11)
+    pieces = list(_reply_pieces(result, "status"))
+    assert pieces[0] == "status"
+    body = pieces[1:]
+    assert len(body) == 11
+    assert body[0].startswith("[1/11]\n\n") and body[-1].startswith("[11/11]\n\n")
+    for piece in body:
+        header, _, chunk = piece.partition("\n\n")
+        # The header fits in the room TELEGRAM_MAX_MSG leaves under Telegram's limit
+        assert len(chunk) <= TELEGRAM_MAX_MSG
+        assert len(piece) <= TELEGRAM_LIMIT
+    assert "".join(p.partition("\n\n")[2] for p in body) == result
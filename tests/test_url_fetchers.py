@@ -0,0 +1,19 @@
+from url_fetchers import _normalize_url
+
+
+def test_twitter_hosts_share_one_key():
+    key = _normalize_url("https://x.com/user/status/1")
+    assert _normalize_url("https://twitter.com/user/status/1") == key
+    assert _normalize_url("http://mobile.twitter.com/user/status/1/") == key
+    assert _normalize_url("www.x.com/user/status/1?s=20&t=abc#frag") == key
+
+
+def test_tracking_params_are_stripped():
+    assert (_normalize_url("https://example.com/a?id=3&utm_source=tg&fbclid=x")
+            == "https://example.com/a?id=3")
+    assert _normalize_url("https://example.com/a?utm_medium=x") == "https://example.com/a"
+
+
+def test_scheme_and_host_are_lowercased_but_path_is_kept():
+    assert _normalize_url("HTTPS://Example.COM/Path#top") == "https://example.com/Path"
+    assert _normalize_url("https://example.com/a?b=1") != _normalize_url("https://example.com/a?b=2")
@@ -0,0 +1,21 @@
+from vision import _split_batch_reply
+
+
+def test_split_in_order():
+    text = "以下是描述：\n[圖片 1] 一隻貓\n[圖片 2] 與 [圖片 1] 相同的貓\n  [圖片3] 圖表"
+    assert _split_batch_reply(text, 3) == ["一隻貓", "與 [圖片 1] 相同的貓", "圖表"]
+
+
+def test_split_rejects_missing_marker():
+    assert _split_batch_reply("[圖片 1] 一隻貓\n[圖片 3] 圖表", 3) is None
+    assert _split_batch_reply("[圖片 1] 一隻貓", 2) is None
+
+
+def test_split_rejects_duplicate_or_out_of_order_markers():
+    assert _split_batch_reply("[圖片 1] 貓\n[圖片 1] 狗", 2) is None
+    assert _split_batch_reply("[圖片 2] 貓\n[圖片 1] 狗", 2) is None
+
+
+def test_split_rejects_empty_section():
+    assert _split_batch_reply("[圖片 1]\n[圖片 2] 狗", 2) is None
+    assert _split_batch_reply("[圖片 1] 貓\n[圖片 2]   \n", 2) is None
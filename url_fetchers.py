@@ -8,10 +8,16 @@ url_fetchers.py — URL 抓取與平台解析模組
 import os
 import re
 import asyncio
+import contextlib
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from typing import Optional, List, Tuple, Dict
 
 logger = logging.getLogger(__name__)
 
@@ -33,94 +39,210 @@ except ImportError:
     lx = None
 
 try:
-    import requests
-    REQUESTS_AVAILABLE = True
+    # lexbor 後端；selectolax 1.0 起舊的 modest 後端 (selectolax.parser) 已淘汰
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+    SELECTOLAX_AVAILABLE = True
 except ImportError:
-    REQUESTS_AVAILABLE = False
-    logger.warning("requests 未安裝，URL 預處理功能將受限")
+    try:
+        from selectolax.parser import HTMLParser
+        SELECTOLAX_AVAILABLE = True
+    except ImportError:
+        SELECTOLAX_AVAILABLE = False
+        HTMLParser = None
+
+try:
+    # fxtwitter 回應直接以 orjson 解析 bytes；未安裝時使用 httpx 內建的 json
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+    httpx = None
+    logger.warning("httpx 未安裝，URL 預處理功能將受限")
 
 # vision 模組 — 延遲 import 避免循環依賴
-from vision import analyze_images, GENAI_AVAILABLE
+from vision import analyze_images, run_gemini, GENAI_AVAILABLE
+
+
+# --- 共用 HTTP client / 執行緒池 ---
+
+# 所有 async fetcher 共用一個連線池；在事件迴圈內首次使用時才建立
+_http_client: Optional["httpx.AsyncClient"] = None
+# client 的預設 User-Agent；fetch_via_http 以瀏覽器 UA 逐請求覆蓋
+_USER_AGENT = "TelegramClaudeBridge/2.6"
+
+# 每個 host 的並行上限；全域上限由呼叫端傳入的 semaphore 控制（URL_FETCH_CONCURRENCY）
+# host -> [semaphore, 持有 + 等待中的請求數]；沒有人使用時即移除，不會隨看過的 host 無限成長
+_HOST_SEMS: Dict[str, list] = {}
+
+# URL 抓取結果快取：url -> (過期時間, content, method_used)，LRU + TTL
+_URL_CACHE: "OrderedDict[str, Tuple[float, Optional[str], Optional[str]]]" = OrderedDict()
+# 抓取失敗的 URL 只短暫記住，避免服務中斷期間重試時反覆等待逾時
+_URL_NEGATIVE_TTL = 60
+
+# yt-dlp 為阻塞式呼叫，使用獨立的有限執行緒池，避免佔滿預設 executor
+_YTDLP_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ytdlp")
+
+
+def _get_http_client() -> "httpx.AsyncClient":
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # 逾時由各請求依 config 傳入；預設跟隨 redirect（與原本 requests 行為一致）
+        # retries 只重試連線建立失敗（ConnectError / ConnectTimeout），不會重送已送出的請求
+        _http_client = httpx.AsyncClient(
+            follow_redirects=True,
+            headers={"User-Agent": _USER_AGENT},
+            transport=httpx.AsyncHTTPTransport(
+                retries=1,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+            ),
+        )
+    return _http_client
+
+
+@contextlib.asynccontextmanager
+async def _host_slot(url: str, cfg: dict):
+    """佔用 URL 所屬 host 的一個請求名額（同一 host 同時最多 URL_FETCH_PER_HOST 個請求）。"""
+    host = urlsplit(url).hostname or ""
+    entry = _HOST_SEMS.get(host)
+    if entry is None:
+        entry = _HOST_SEMS[host] = [asyncio.Semaphore(cfg.get("URL_FETCH_PER_HOST", 2)), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _HOST_SEMS[host]
+
+
+async def _http_get(url: str, cfg: dict, **kwargs) -> "httpx.Response":
+    """經由共用 client 發出 GET，受 per-host 並行上限約束。"""
+    async with _host_slot(url, cfg):
+        return await _get_http_client().get(url, **kwargs)
+
+
+async def close_http_client() -> None:
+    """關閉共用 HTTP client（於 bot 關閉時呼叫）。"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 
 # --- URL 偵測與分類 ---
 
 PLATFORM_PATTERNS = {
     "x_twitter": [
-        r"(?:https?://)?(?:www\.)?(?:twitter\.com|x\.com)/\S+",
+        r"(?:https?://)?(?:(?:www|mobile)\.)?(?:twitter\.com|x\.com)/\S+",
         r"(?:https?://)?t\.co/\S+",
     ],
     "youtube": [
-        r"(?:https?://)?(?:www\.)?youtube\.com/watch\S+",
+        r"(?:https?://)?(?:(?:www|m|music)\.)?youtube\.com/watch\S+",
         r"(?:https?://)?youtu\.be/\S+",
-        r"(?:https?://)?(?:www\.)?youtube\.com/shorts/\S+",
+        r"(?:https?://)?(?:(?:www|m|music)\.)?youtube\.com/shorts/\S+",
     ],
     "general": [
         r"https?://\S+",
     ],
 }
 
+# 合併成單一 regex（每個平台一個 named group），一次掃描即可分類；
+# alternation 依序嘗試，故特定平台優先於 general
+_URL_RE = re.compile("|".join(
+    f"(?P<{platform}>{'|'.join(patterns)})"
+    for platform, patterns in PLATFORM_PATTERNS.items()
+))
+_GENERAL_URL_RE = re.compile(f"(?P<general>{'|'.join(PLATFORM_PATTERNS['general'])})")
+
+# 平台 pattern 的必要子字串；都不出現時可跳過平台 regex（pattern 皆區分大小寫）
+_PLATFORM_HINTS = ("twitter.com", "x.com", "t.co/", "youtube.com", "youtu.be")
+
+# Twitter Article block type → markdown 前綴（header-one/two/... 另外處理；unstyled 等無前綴）
+_ARTICLE_BLOCK_PREFIX = {
+    "blockquote": "> ",
+    "ordered-list-item": "- ",
+    "unordered-list-item": "- ",
+}
+
+# fetch_via_http 的 HTML 擷取（未安裝 selectolax 時的 regex 後備方案）
+_HTML_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+# <meta> 以單次掃描取得標籤，再解析屬性：不受 property/name 與 content 的先後順序影響
+_HTML_META_TAG_RE = re.compile(r'<meta\s[^>]*>', re.IGNORECASE)
+_HTML_ATTR_RE = re.compile(r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+_WANTED_META = ("og:title", "og:description", "description")
+_WHITESPACE_RE = re.compile(r'\s+')
+_UNSAFE_FILENAME_RE = re.compile(r"[^a-zA-Z0-9]")
+
 
 def detect_urls(text: str) -> List[Tuple[str, str]]:
     """
     從訊息中偵測 URL 並分類平台。
-    回傳 [(url, platform), ...] 的列表。
-    優先匹配特定平台，最後才匹配 general。
+    回傳 [(url, platform), ...] 的列表，依 URL 在訊息中出現的順序。
+    同一位置優先匹配特定平台，最後才匹配 general。
     """
+    # 大多數訊息不含 URL：先用子字串檢查，避免逐一跑 regex
+    has_platform = any(hint in text for hint in _PLATFORM_HINTS)
+    if not has_platform and "http" not in text:
+        return []
+
     found = []
     found_urls = set()
 
-    for platform in ["x_twitter", "youtube"]:
-        for pattern in PLATFORM_PATTERNS[platform]:
-            for match in re.finditer(pattern, text):
-                url = match.group(0)
-                if url not in found_urls:
-                    found_urls.add(url)
-                    found.append((url, platform))
-
-    for pattern in PLATFORM_PATTERNS["general"]:
-        for match in re.finditer(pattern, text):
-            url = match.group(0)
-            if url not in found_urls:
-                found_urls.add(url)
-                found.append((url, "general"))
+    pattern = _URL_RE if has_platform else _GENERAL_URL_RE
+    for match in pattern.finditer(text):
+        url = match.group(0)
+        if url not in found_urls:
+            found_urls.add(url)
+            found.append((url, match.lastgroup))
 
     return found
 
 
 # --- 方案 D: fxtwitter (X/Twitter 專用) ---
 
-def fetch_via_fxtwitter(url: str, config: dict = None) -> Optional[Tuple[str, List[str]]]:
+def _fxtwitter_api_url(url: str) -> Optional[str]:
+    """把 x.com / twitter.com 推文 URL 換成 api.fxtwitter.com；其他 host（如 t.co 短網址）回傳 None。"""
+    parts = urlsplit(url if "://" in url else "https://" + url)
+    if parts.netloc.lower() not in _TWITTER_HOSTS:
+        return None
+    return urlunsplit(("https", "api.fxtwitter.com", parts.path, parts.query, ""))
+
+
+async def fetch_via_fxtwitter(url: str, config: dict = None) -> Optional[Tuple[str, List[str], str]]:
     """
     用 fxtwitter.com API 抓取 X/Twitter 推文內容。
     將 x.com / twitter.com 替換成 api.fxtwitter.com 取得 JSON。
-    回傳 (text_content, image_urls) tuple，或 None。
+    回傳 (text_content, image_urls, tweet_text) tuple，或 None。
+    tweet_text 為推文原文（供圖片分析當 context），不需再從格式化內容中解析。
     """
-    if not REQUESTS_AVAILABLE:
+    if not HTTPX_AVAILABLE:
         return None
 
     cfg = config or {}
     fetch_timeout = cfg.get("URL_FETCH_TIMEOUT", 15)
     max_images = cfg.get("MAX_IMAGES_PER_MESSAGE", 5)
 
-    try:
-        api_url = re.sub(
-            r"https?://(www\.)?(twitter\.com|x\.com)",
-            "https://api.fxtwitter.com",
-            url
-        )
+    api_url = _fxtwitter_api_url(url)
+    if api_url is None:
+        return None
 
+    try:
         logger.info(f"[fxtwitter] 嘗試抓取: {api_url}")
 
-        resp = requests.get(api_url, timeout=fetch_timeout, headers={
-            "User-Agent": "TelegramClaudeBridge/2.6"
-        })
+        resp = await _http_get(api_url, cfg, timeout=fetch_timeout)
 
         if resp.status_code != 200:
             logger.warning(f"[fxtwitter] HTTP {resp.status_code}")
             return None
 
-        data = resp.json()
+        data = orjson.loads(resp.content) if ORJSON_AVAILABLE else resp.json()
         tweet = data.get("tweet", {})
 
         if not tweet:
@@ -150,16 +272,13 @@ def fetch_via_fxtwitter(url: str, config: dict = None) -> Optional[Tuple[str, Li
                 article_texts = []
                 for block in content_blocks:
                     block_text = block.get("text", "").strip()
-                    if block_text:
-                        block_type = block.get("type", "unstyled")
-                        if block_type.startswith("header"):
-                            article_texts.append(f"\n## {block_text}")
-                        elif block_type == "blockquote":
-                            article_texts.append(f"> {block_text}")
-                        elif block_type in ("ordered-list-item", "unordered-list-item"):
-                            article_texts.append(f"- {block_text}")
-                        else:
-                            article_texts.append(block_text)
+                    if not block_text:
+                        continue
+                    block_type = block.get("type", "unstyled")
+                    if block_type.startswith("header"):
+                        article_texts.append(f"\n## {block_text}")
+                    else:
+                        article_texts.append(_ARTICLE_BLOCK_PREFIX.get(block_type, "") + block_text)
                 if article_texts:
                     article_body = "\n".join(article_texts)
                     parts.append(f"📝 長文內容:\n{article_body}")
@@ -211,9 +330,9 @@ def fetch_via_fxtwitter(url: str, config: dict = None) -> Optional[Tuple[str, Li
 
         result = "\n".join(parts)
         logger.info(f"[fxtwitter] 成功抓取推文，{len(result)} 字元，{len(image_urls)} 張圖片 URL")
-        return result, image_urls
+        return result, image_urls, text
 
-    except requests.Timeout:
+    except httpx.TimeoutException:
         logger.warning(f"[fxtwitter] 請求超時")
         return None
     except Exception as e:
@@ -223,6 +342,24 @@ def fetch_via_fxtwitter(url: str, config: dict = None) -> Optional[Tuple[str, Li
 
 # --- 方案 C: yt-dlp (通用備用) ---
 
+# 建立 YoutubeDL 會初始化全部 extractor，成本高；每個 _YTDLP_EXECUTOR 執行緒重用一個實例
+# （YoutubeDL 非 thread-safe，不能跨執行緒共用）
+_ydl_local = threading.local()
+
+
+def _get_ytdlp(fetch_timeout: int) -> "yt_dlp.YoutubeDL":
+    ydl = getattr(_ydl_local, "ydl", None)
+    if ydl is None or _ydl_local.timeout != fetch_timeout:
+        ydl = _ydl_local.ydl = yt_dlp.YoutubeDL({
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+            'socket_timeout': fetch_timeout,
+        })
+        _ydl_local.timeout = fetch_timeout
+    return ydl
+
+
 def fetch_via_ytdlp(url: str, config: dict = None) -> Optional[str]:
     """
     用 yt-dlp 提取 URL 的 metadata（不下載檔案）。
@@ -237,15 +374,7 @@ def fetch_via_ytdlp(url: str, config: dict = None) -> Optional[str]:
     try:
         logger.info(f"[yt-dlp] 嘗試抓取: {url}")
 
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'skip_download': True,
-            'socket_timeout': fetch_timeout,
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+        info = _get_ytdlp(fetch_timeout).extract_info(url, download=False)
 
         if not info:
             return None
@@ -312,12 +441,56 @@ def fetch_via_ytdlp(url: str, config: dict = None) -> Optional[str]:
 
 # --- 方案 fallback: 基本 HTTP 抓取 ---
 
-def fetch_via_http(url: str, config: dict = None) -> Optional[str]:
+# 只需要 <head> 內的 title / meta：最多讀取這麼多 bytes，其餘內容不下載
+_HTTP_READ_BYTES = 64 * 1024
+_HTML_CONTENT_TYPES = ("text/html", "application/xhtml")
+
+def _pick_meta(attr_dicts) -> Tuple[Optional[str], Optional[str]]:
+    """
+    從各 <meta> 的屬性 dict 取出 (og:title, description)，第一個出現者為準。
+    以 property 或 name 的值（不分大小寫）識別，與屬性順序無關。
+    """
+    metas = {}
+    for attrs in attr_dicts:
+        key = (attrs.get("property") or attrs.get("name") or "").lower()
+        if key in _WANTED_META and key not in metas:
+            metas[key] = attrs.get("content")
+    desc = metas.get("og:description") or metas.get("description")
+    return metas.get("og:title") or None, desc or None
+
+
+def _extract_page_meta(html: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    從 HTML 擷取 (title, og:title, description)。
+    有 selectolax 時單次 C 解析；否則退回 regex（<title> 一次、<meta> 一次）。
+    description 優先取 og:description，其次 meta name=description。
+    """
+    if SELECTOLAX_AVAILABLE:
+        tree = HTMLParser(html)
+        title_node = tree.css_first("title")
+        title = _WHITESPACE_RE.sub(' ', title_node.text()).strip() if title_node is not None else None
+        og_title, desc = _pick_meta(node.attributes for node in tree.css("meta"))
+        return title, og_title, desc
+
+    # regex 皆為 IGNORECASE：先對小寫副本做子字串檢查，頁面沒有的部分就不跑 regex
+    lowered = html.lower()
+    title_match = _HTML_TITLE_RE.search(html) if "<title" in lowered else None
+    title = _WHITESPACE_RE.sub(' ', title_match.group(1)).strip() if title_match else None
+    if "<meta" not in lowered:
+        return title, None, None
+    og_title, desc = _pick_meta(
+        {k.lower(): dq or sq or bare for k, dq, sq, bare in _HTML_ATTR_RE.findall(tag.group(0))}
+        for tag in _HTML_META_TAG_RE.finditer(html)
+    )
+    return title, og_title, desc
+
+
+async def fetch_via_http(url: str, config: dict = None) -> Optional[str]:
     """
     基本 HTTP GET，嘗試抓取頁面標題和 meta description。
     作為最後的 fallback。
     """
-    if not REQUESTS_AVAILABLE:
+    if not HTTPX_AVAILABLE:
         return None
 
     cfg = config or {}
@@ -326,30 +499,35 @@ def fetch_via_http(url: str, config: dict = None) -> Optional[str]:
     try:
         logger.info(f"[http] 嘗試抓取: {url}")
 
-        resp = requests.get(url, timeout=fetch_timeout, headers={
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        }, allow_redirects=True)
+        async with _host_slot(url, cfg), _get_http_client().stream("GET", url, timeout=fetch_timeout, headers={
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            "Accept": "text/html,application/xhtml+xml",
+        }) as resp:
+            if resp.status_code != 200:
+                return None
 
-        if resp.status_code != 200:
-            return None
+            # 影片、PDF 等非 HTML 內容沒有可擷取的 meta，不下載 body
+            content_type = resp.headers.get("Content-Type", "")
+            if content_type and not content_type.startswith(_HTML_CONTENT_TYPES):
+                logger.info(f"[http] 非 HTML 內容 ({content_type})，跳過")
+                return None
+
+            buf = bytearray()
+            async for chunk in resp.aiter_bytes():
+                buf += chunk
+                if len(buf) >= _HTTP_READ_BYTES:
+                    break
 
-        content = resp.text[:10000]
+        # 整段前綴都交給解析：<title> / og: meta 常落在大型 inline script/style 之後
+        content = buf[:_HTTP_READ_BYTES].decode(resp.encoding or "utf-8", errors="replace")
 
         parts = [f"🔗 來源: {url}"]
 
-        title_match = re.search(r'<title[^>]*>(.*?)</title>', content, re.IGNORECASE | re.DOTALL)
-        if title_match:
-            title = re.sub(r'\s+', ' ', title_match.group(1)).strip()
+        title, og_title, desc = _extract_page_meta(content)
+        if title:
             parts.append(f"📌 標題: {title}")
-
-        og_title = re.search(r'<meta[^>]*property=["\']og:title["\'][^>]*content=["\'](.*?)["\']', content, re.IGNORECASE)
-        og_desc = re.search(r'<meta[^>]*property=["\']og:description["\'][^>]*content=["\'](.*?)["\']', content, re.IGNORECASE)
-        meta_desc = re.search(r'<meta[^>]*name=["\']description["\'][^>]*content=["\'](.*?)["\']', content, re.IGNORECASE)
-
         if og_title:
-            parts.append(f"📌 OG 標題: {og_title.group(1)}")
-
-        desc = (og_desc and og_desc.group(1)) or (meta_desc and meta_desc.group(1))
+            parts.append(f"📌 OG 標題: {og_title}")
         if desc:
             parts.append(f"📝 描述: {desc}")
 
@@ -410,40 +588,36 @@ def extract_structured_data(text, prompt=None):
 
 # --- Fetch Output 儲存 ---
 
-def save_fetch_output(url, fetched_content, claude_response, user_note="", config: dict = None):
-    """Save AI-friendly markdown summary to fetch_outputs/."""
+def save_fetch_output(url, fetched_content, claude_response, user_note="", config: dict = None,
+                      other_urls=()):
+    """Save AI-friendly markdown summary to fetch_outputs/.
+
+    url names the file; other_urls (further links fetched in the same message) are listed in the header.
+    """
     cfg = config or {}
     output_dir = cfg.get("FETCH_OUTPUT_DIR", Path(r"C:\telegram-MCP-bridge\fetch_outputs"))
 
     try:
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_url = re.sub(r"[^a-zA-Z0-9]", "_", url[:60])
+        now = datetime.now()
+        ts = now.strftime("%Y%m%d_%H%M%S")
+        safe_url = _UNSAFE_FILENAME_RE.sub("_", url[:60])
         filename = f"fetch_{ts}_{safe_url}.md"
         filepath = output_dir / filename
-        sep = chr(10)
-        parts = []
-        parts.append("# AI-Friendly Content Summary")
-        parts.append("")
-        parts.append(f"- **Source**: {url}")
-        parts.append(f"- **Fetched**: {datetime.now().isoformat()}")
-        if user_note:
-            parts.append(f"- **User Note**: {user_note}")
-        parts.append("")
-        parts.append("---")
-        parts.append("")
-        parts.append("## Fetched Content")
-        parts.append("")
-        parts.append(fetched_content)
-        parts.append("")
-        parts.append("---")
-        parts.append("")
-        parts.append("## Claude Analysis")
-        parts.append("")
-        parts.append(claude_response)
-        content = sep.join(parts)
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(content)
-        logger.info(f"[fetch] Saved: {filepath} ({len(content)} chars)")
+        # 內容與回覆原樣逐段寫入，不先串成整份文件（大型分析不會在記憶體中多一份副本）
+        sections = (
+            f"# AI-Friendly Content Summary\n\n"
+            f"- **Source**: {url}\n"
+            + "".join(f"- **Source**: {other}\n" for other in other_urls)
+            + f"- **Fetched**: {now.isoformat()}\n",
+            f"- **User Note**: {user_note}\n" if user_note else "",
+            "\n---\n\n## Fetched Content\n\n",
+            fetched_content,
+            "\n\n---\n\n## Claude Analysis\n\n",
+            claude_response,
+        )
+        with open(filepath, "w", encoding="utf-8", buffering=1 << 16) as f:
+            f.writelines(sections)
+        logger.info(f"[fetch] Saved: {filepath} ({sum(map(len, sections))} chars)")
         return str(filepath)
     except Exception as e:
         logger.error(f"[fetch] Save failed: {e}")
@@ -452,7 +626,133 @@ def save_fetch_output(url, fetched_content, claude_response, user_note="", confi
 
 # --- URL 預處理編排器 ---
 
-async def preprocess_urls(text: str, config: dict = None) -> Tuple[str, List[str]]:
+# 只影響追蹤、不影響頁面內容的 query 參數（utm_* 另以前綴判斷）
+_TRACKING_PARAMS = frozenset({"fbclid", "gclid", "igshid", "mc_cid", "mc_eid", "si", "ref_src", "ref_url"})
+
+# 同一則推文的各種 host 寫法；推文 URL 的 query（?s=20&t=...）只有分享追蹤用途
+_TWITTER_HOSTS = frozenset({
+    "twitter.com", "www.twitter.com", "mobile.twitter.com",
+    "x.com", "www.x.com", "mobile.x.com",
+})
+
+
+def _normalize_url(url: str) -> str:
+    """
+    將 URL 正規化為快取 / 去重 key：補上 scheme、scheme/host 轉小寫、去除 fragment 與追蹤參數，
+    twitter.com / x.com 統一為 x.com。僅用於比對，抓取時仍使用原始 URL。
+    """
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    netloc = parts.netloc.lower()
+    query = parts.query
+    if netloc in _TWITTER_HOSTS:
+        return urlunsplit(("https", "x.com", parts.path.rstrip("/"), "", ""))
+    if query:
+        query = urlencode([
+            (k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+            if not k.startswith("utm_") and k not in _TRACKING_PARAMS
+        ])
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path, query, ""))
+
+
+def _url_cache_get(url: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    entry = _URL_CACHE.get(url)
+    if entry is None:
+        return None
+    expires_at, content, method_used = entry
+    if expires_at < time.monotonic():
+        del _URL_CACHE[url]
+        return None
+    _URL_CACHE.move_to_end(url)
+    return content, method_used
+
+
+def _url_cache_put(url: str, content: Optional[str], method_used: Optional[str], cfg: dict) -> None:
+    max_size = cfg.get("URL_CACHE_SIZE", 512)
+    if max_size <= 0:
+        return
+    ttl = cfg.get("URL_CACHE_TTL", 900) if content else _URL_NEGATIVE_TTL
+    _URL_CACHE[url] = (time.monotonic() + ttl, content, method_used)
+    _URL_CACHE.move_to_end(url)
+    while len(_URL_CACHE) > max_size:
+        _URL_CACHE.popitem(last=False)
+
+
+# --- 平台抓取鏈 ---
+# 每個步驟回傳 (content, method_used, images) 或 None；依序嘗試直到成功。
+# images 為待分析的 (image_urls, tweet_text)，由呼叫端在釋放抓取額度後交給 analyze_images
+_Images = Optional[Tuple[List[str], str]]
+
+async def _try_fxtwitter(url: str, cfg: dict) -> Optional[Tuple[str, str, _Images]]:
+    fxt_result = await fetch_via_fxtwitter(url, cfg)
+    if fxt_result is None:
+        return None
+    content, image_urls, tweet_text = fxt_result
+    return content, "fxtwitter", ((image_urls, tweet_text) if image_urls else None)
+
+
+async def _try_ytdlp(url: str, cfg: dict) -> Optional[Tuple[str, str, _Images]]:
+    content = await asyncio.get_running_loop().run_in_executor(
+        _YTDLP_EXECUTOR, fetch_via_ytdlp, url, cfg
+    )
+    return (content, "yt-dlp", None) if content else None
+
+
+async def _try_http(url: str, cfg: dict) -> Optional[Tuple[str, str, _Images]]:
+    content = await fetch_via_http(url, cfg)
+    return (content, "http", None) if content else None
+
+
+# 新增平台只需在這裡加一條抓取鏈；http 一律作為最後的通用 fallback
+_FETCHER_CHAIN = {
+    "x_twitter": (_try_fxtwitter, _try_ytdlp, _try_http),
+    "youtube": (_try_ytdlp, _try_http),
+    "general": (_try_http,),
+}
+
+
+async def _fetch_one(url: str, platform: str, cfg: dict) -> Tuple[Optional[str], Optional[str], _Images]:
+    """
+    依平台策略（_FETCHER_CHAIN）抓取單一 URL。
+    回傳 (content, method_used, images)，抓取失敗時 content 為 None。
+    """
+    for fetch in _FETCHER_CHAIN.get(platform, _FETCHER_CHAIN["general"]):
+        result = await fetch(url, cfg)
+        if result:
+            return result
+
+    return None, None, None
+
+
+async def _analyze_one(content: Optional[str], method_used: Optional[str], images: _Images,
+                       cfg: dict) -> Tuple[Optional[str], Optional[str]]:
+    """層次二：通用圖片分析，把圖片描述接在推文內容之後。"""
+    if images:
+        image_urls, tweet_text = images
+        image_descriptions = await analyze_images(
+            image_urls, tweet_text, cfg, client=_get_http_client()
+        )
+        if image_descriptions:
+            content = content + "\n\n" + image_descriptions
+            method_used = f"{method_used}+img"
+    return content, method_used
+
+
+async def _enhance_one(url: str, platform: str, content: Optional[str], method_used: Optional[str],
+                       cfg: dict) -> Tuple[Optional[str], Optional[str]]:
+    """一般網頁的 LangExtract 強化；與圖片分析共用 Gemini 並行額度。"""
+    if content and platform == "general" and LANGEXTRACT_AVAILABLE and len(content) > 300:
+        enhanced = await run_gemini(cfg, enhance_with_langextract, content, url)
+        if enhanced:
+            content = enhanced
+            method_used = f"{method_used}+LE"
+    return content, method_used
+
+
+async def preprocess_urls(text: str, config: dict = None,
+                          semaphore: Optional[asyncio.Semaphore] = None
+                          ) -> Tuple[str, List[str], List[Tuple[str, str]]]:
     """
     偵測訊息中的 URL，自動抓取內容，回傳增強後的訊息。
 
@@ -461,75 +761,92 @@ async def preprocess_urls(text: str, config: dict = None) -> Tuple[str, List[str
     - YouTube/其他 yt-dlp 支援平台: yt-dlp (方案C) → http fallback
     - 其他 URL: http fallback
 
-    回傳: (增強後的完整訊息, 處理摘要列表)
+    多個 URL 會並行抓取；config 的 URL_TOTAL_TIMEOUT（秒，0 為不限）限制整體等待時間。
+    semaphore: 可選，由呼叫端共用以限制跨訊息同時進行的 URL 抓取數量。
+
+    回傳: (增強後的完整訊息, 處理摘要列表, 偵測到的 (url, platform) 列表)
+    呼叫端可直接使用第三個值，不必再對原文呼叫一次 detect_urls()。
     """
     cfg = config or {}
     urls = detect_urls(text)
 
     if not urls:
-        return text, []
+        return text, [], urls
 
     logger.info(f"偵測到 {len(urls)} 個 URL: {urls}")
 
+    # 已抓到、但 Gemini 步驟尚未完成的內容；總時限到時仍可使用，逾時只會少掉圖片描述 / LangExtract
+    partial: Dict[str, Tuple[str, str]] = {}
+
+    async def fetch_limited(key: str, url: str, platform: str):
+        cached = _url_cache_get(key)
+        if cached is not None:
+            logger.info(f"URL 快取命中 (cache-hit): {url}")
+            return cached
+        async with semaphore or contextlib.nullcontext():
+            content, method_used, images = await _fetch_one(url, platform, cfg)
+        if content:
+            partial[key] = (content, method_used)
+        # 圖片分析與 LangExtract 在釋放抓取額度後才執行，等待 Gemini 時不佔用 URL_FETCH_CONCURRENCY
+        content, method_used = await _analyze_one(content, method_used, images, cfg)
+        content, method_used = await _enhance_one(url, platform, content, method_used, cfg)
+        _url_cache_put(key, content, method_used, cfg)
+        return content, method_used
+
+    # 指向同一內容的 URL（x.com / twitter.com、追蹤參數不同）只抓一次，以第一次出現者為準
+    keys = [_normalize_url(url) for url, _ in urls]
+    unique: Dict[str, Tuple[str, str]] = {}
+    for key, (url, platform) in zip(keys, urls):
+        unique.setdefault(key, (url, platform))
+
+    # 各 URL 並行抓取，整體受 URL_TOTAL_TIMEOUT 限制：逾時仍未完成的 URL 取消，已抓到內容者
+    # 只略過圖片分析 / LangExtract，其餘標示逾時；避免單一慢連結（多層 fallback 各自逾時）拖住整則回覆
+    tasks = {
+        key: asyncio.ensure_future(fetch_limited(key, url, platform))
+        for key, (url, platform) in unique.items()
+    }
+    total_timeout = cfg.get("URL_TOTAL_TIMEOUT", 0) or None
+    _, pending = await asyncio.wait(tasks.values(), timeout=total_timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"URL 抓取超過 {total_timeout}s 總時限，取消 {len(pending)} 個")
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    results = {}
+    for key, task in tasks.items():
+        if task in pending and key in partial:
+            content, method_used = partial[key]
+            results[key] = (content, f"{method_used}（Gemini 逾時略過）")
+        elif task in pending:
+            results[key] = asyncio.TimeoutError()
+        elif task.exception() is not None:
+            results[key] = task.exception()
+        else:
+            results[key] = task.result()
+
     enrichments = []
     summaries = []
-
-    for url, platform in urls:
-        content = None
-        method_used = None
-
-        if platform == "x_twitter":
-            # X/Twitter: fxtwitter (回傳 tuple) → yt-dlp → http
-            fxt_result = await asyncio.get_event_loop().run_in_executor(
-                None, fetch_via_fxtwitter, url, cfg
-            )
-            if fxt_result is not None:
-                content, image_urls = fxt_result
-                method_used = "fxtwitter"
-
-                # 層次二：通用圖片分析
-                if image_urls:
-                    tweet_text = ""
-                    for line in content.split("\n"):
-                        if line.startswith("📝 內容:"):
-                            tweet_text = line.replace("📝 內容:", "").strip()
-                            break
-                    image_descriptions = await asyncio.get_event_loop().run_in_executor(
-                        None, analyze_images, image_urls, tweet_text, cfg
-                    )
-                    if image_descriptions:
-                        content = content + "\n\n" + image_descriptions
-                        method_used = "fxtwitter+img"
-            else:
-                content = await asyncio.get_event_loop().run_in_executor(
-                    None, fetch_via_ytdlp, url, cfg
-                )
-                if content:
-                    method_used = "yt-dlp"
-
-        elif platform == "youtube":
-            content = await asyncio.get_event_loop().run_in_executor(
-                None, fetch_via_ytdlp, url, cfg
-            )
-            if content:
-                method_used = "yt-dlp"
-
-        # 通用 fallback
-        if not content:
-            content = await asyncio.get_event_loop().run_in_executor(
-                None, fetch_via_http, url, cfg
-            )
-            if content:
-                method_used = "http"
+    enriched_keys = set()
+
+    for key, (url, platform) in zip(keys, urls):
+        result = results[key]
+        if key in enriched_keys:
+            summaries.append(f"✅ {url} → 同上（重複連結）")
+            continue
+        if isinstance(result, asyncio.TimeoutError):
+            summaries.append(f"⏱️ {url} → 抓取逾時")
+            logger.warning(f"URL 處理逾時: {url}")
+            continue
+        if isinstance(result, BaseException):
+            logger.error(f"URL 處理錯誤: {url}: {result}")
+            content, method_used = None, None
+        else:
+            content, method_used = result
 
         if content:
-            # LangExtract enhancement for general URLs
-            if platform == "general" and LANGEXTRACT_AVAILABLE and len(content) > 300:
-                enhanced = await asyncio.get_event_loop().run_in_executor(None, enhance_with_langextract, content, url)
-                if enhanced:
-                    content = enhanced
-                    method_used = f"{method_used}+LE"
             enrichments.append(content)
+            enriched_keys.add(key)
             summaries.append(f"✅ {url} → {method_used}")
             logger.info(f"URL 處理成功: {url} via {method_used}")
         else:
@@ -546,6 +863,6 @@ async def preprocess_urls(text: str, config: dict = None) -> Tuple[str, List[str
             f"=== 連結內容結束 ===\n"
             f"請基於上述連結內容來回應使用者的訊息。"
         )
-        return enhanced_text, summaries
+        return enhanced_text, summaries, urls
 
-    return text, summaries
+    return text, summaries, urls
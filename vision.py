@@ -7,8 +7,11 @@ vision.py — 通用圖片理解模組
 """
 
 import os
-import base64
+import re
+import asyncio
+import hashlib
 import logging
+from collections import OrderedDict
 from typing import Optional, List, Tuple
 
 logger = logging.getLogger(__name__)
@@ -16,10 +19,11 @@ logger = logging.getLogger(__name__)
 # --- 可用性檢測 ---
 
 try:
-    import requests
-    _REQUESTS_AVAILABLE = True
+    import httpx
+    _HTTPX_AVAILABLE = True
 except ImportError:
-    _REQUESTS_AVAILABLE = False
+    _HTTPX_AVAILABLE = False
+    httpx = None
 
 try:
     import google.generativeai as genai
@@ -42,53 +46,108 @@ _DEFAULT_CONFIG = {
     "IMAGE_ANALYSIS_ENABLED": True,
     "MAX_IMAGES_PER_MESSAGE": 5,
     "IMAGE_ANALYSIS_TIMEOUT": 30,
+    "GEMINI_CONCURRENCY": 4,
 }
 
+# Gemini inline 圖片的大小上限
+_MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+# 批次回覆中每張圖片的段落標記，例如「[圖片 2]」；只認行首的標記，
+# 描述內文提到其他圖片（「與 [圖片 1] 相同」）時不會被誤當成分段
+_IMAGE_MARKER_RE = re.compile(r"^[ \t]*\[圖片\s*(\d+)\]", re.MULTILINE)
+
+# 圖片描述快取：(圖片內容 digest, context) → 描述，LRU 淘汰
+# 轉推 / 重複貼文 / 相同 GIF 縮圖不需再呼叫 Gemini
+_DESC_CACHE: "OrderedDict[Tuple[bytes, str], str]" = OrderedDict()
+_DESC_CACHE_SIZE = 1024
+
+
+# 同時進行的 Gemini 呼叫上限（跨訊息共用），避免佔滿 to_thread 的預設執行緒池
+_gemini_sem: Optional[asyncio.Semaphore] = None
+
+
+def _get_gemini_sem(cfg: dict) -> asyncio.Semaphore:
+    global _gemini_sem
+    if _gemini_sem is None:
+        _gemini_sem = asyncio.Semaphore(cfg.get("GEMINI_CONCURRENCY", 4))
+    return _gemini_sem
+
+
+async def run_gemini(cfg: dict, func, *args):
+    """
+    在執行緒中執行同步的 Gemini 呼叫，受 GEMINI_CONCURRENCY 限制。
+    其他模組的 Gemini 呼叫（如 LangExtract）也應經由此函式，共用同一個額度。
+    """
+    async with _get_gemini_sem(cfg):
+        return await asyncio.to_thread(func, *args)
+
+
+def _desc_cache_key(image_bytes: bytes, context: str) -> Tuple[bytes, str]:
+    # prompt 只用到 context 前 500 字，key 也只取這段
+    return hashlib.blake2b(image_bytes, digest_size=16).digest(), context[:500]
+
+
+def _desc_cache_put(key: Tuple[bytes, str], description: str) -> None:
+    _DESC_CACHE[key] = description
+    _DESC_CACHE.move_to_end(key)
+    while len(_DESC_CACHE) > _DESC_CACHE_SIZE:
+        _DESC_CACHE.popitem(last=False)
+
 
 # === 核心函式 ===
 
-def download_image_to_base64(image_url: str, timeout: int = 30) -> Optional[Tuple[str, str]]:
+async def download_image_bytes(client: "httpx.AsyncClient", image_url: str,
+                               timeout: int = 30) -> Optional[Tuple[bytes, str]]:
     """
-    下載圖片到記憶體並轉換為 base64。
-    回傳 (base64_data, mime_type) 或 None。
+    下載圖片到記憶體。
+    回傳 (image_bytes, mime_type) 或 None。
     不寫入磁碟，全程在記憶體中處理。
+    User-Agent 等預設 header 由傳入的 client 設定。
     """
-    if not _REQUESTS_AVAILABLE:
-        return None
     try:
         logger.info(f"[image] 下載圖片: {image_url[:80]}")
-        resp = requests.get(
+        async with client.stream(
+            "GET",
             image_url,
             timeout=timeout,
-            headers={"User-Agent": "TelegramClaudeBridge/2.6"},
-        )
-        if resp.status_code != 200:
-            logger.warning(f"[image] HTTP {resp.status_code} for {image_url[:80]}")
-            return None
+        ) as resp:
+            if resp.status_code != 200:
+                logger.warning(f"[image] HTTP {resp.status_code} for {image_url[:80]}")
+                return None
 
-        content_type = resp.headers.get("Content-Type", "image/jpeg")
-        if "png" in content_type:
-            mime_type = "image/png"
-        elif "gif" in content_type:
-            mime_type = "image/gif"
-        elif "webp" in content_type:
-            mime_type = "image/webp"
-        else:
-            mime_type = "image/jpeg"
+            content_type = resp.headers.get("Content-Type", "image/jpeg")
+            if "png" in content_type:
+                mime_type = "image/png"
+            elif "gif" in content_type:
+                mime_type = "image/gif"
+            elif "webp" in content_type:
+                mime_type = "image/webp"
+            else:
+                mime_type = "image/jpeg"
+
+            # 有 Content-Length 時先檢查，過大的圖片完全不下載
+            declared = resp.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > _MAX_IMAGE_BYTES:
+                logger.warning(f"[image] 圖片太大 ({declared} bytes)，跳過")
+                return None
+
+            # 邊讀邊計算大小，超過上限立即中止，記憶體用量不受遠端檔案大小影響
+            buf = bytearray()
+            async for chunk in resp.aiter_bytes():
+                buf += chunk
+                if len(buf) > _MAX_IMAGE_BYTES:
+                    logger.warning(f"[image] 圖片太大 (>{_MAX_IMAGE_BYTES} bytes)，跳過")
+                    return None
 
-        image_bytes = resp.content
+        image_bytes = bytes(buf)
         if len(image_bytes) < 1000:
             logger.warning(f"[image] 圖片太小 ({len(image_bytes)} bytes)，跳過")
             return None
-        if len(image_bytes) > 20 * 1024 * 1024:
-            logger.warning(f"[image] 圖片太大 ({len(image_bytes)} bytes)，跳過")
-            return None
 
-        b64_data = base64.b64encode(image_bytes).decode('utf-8')
         logger.info(f"[image] 下載成功，{len(image_bytes)} bytes, {mime_type}")
-        return b64_data, mime_type
+        return image_bytes, mime_type
 
-    except requests.Timeout:
+    except httpx.TimeoutException:
         logger.warning(f"[image] 下載超時: {image_url[:80]}")
         return None
     except Exception as e:
@@ -96,9 +155,10 @@ def download_image_to_base64(image_url: str, timeout: int = 30) -> Optional[Tupl
         return None
 
 
-def describe_image_via_gemini(b64_data: str, mime_type: str, context: str = "") -> Optional[str]:
+def describe_image_via_gemini(image_bytes: bytes, mime_type: str, context: str = "") -> Optional[str]:
     """
     使用 Gemini 2.0 Flash Vision API 描述單張圖片。
+    image_bytes 直接以原始 bytes 傳給 SDK（不經 base64 往返）。
     context: 可選的上下文提示（例如推文文字），幫助 Gemini 更好理解圖片。
     回傳圖片描述文字或 None。
     """
@@ -123,7 +183,7 @@ def describe_image_via_gemini(b64_data: str, mime_type: str, context: str = "")
 
         response = model.generate_content([
             prompt_text,
-            {"mime_type": mime_type, "data": b64_data}
+            {"mime_type": mime_type, "data": image_bytes}
         ])
         description = response.text.strip()
 
@@ -137,14 +197,71 @@ def describe_image_via_gemini(b64_data: str, mime_type: str, context: str = "")
         return None
 
 
-def analyze_images(image_urls: List[str], context: str = "", config: dict = None) -> Optional[str]:
+def _split_batch_reply(text: str, count: int) -> Optional[List[str]]:
+    """
+    依行首的「[圖片 N]」標記把批次回覆拆成 count 段描述。
+    標記必須恰好依序為 1..count 且各段皆有內容；缺漏、重複或順序錯亂時回傳 None。
+    """
+    # re.split 搭配捕獲群組：[前言, 編號, 內容, 編號, 內容, ...]
+    pieces = _IMAGE_MARKER_RE.split(text)
+    numbers = [int(num) for num in pieces[1::2]]
+    descriptions = [body.strip() for body in pieces[2::2]]
+    if numbers != list(range(1, count + 1)) or not all(descriptions):
+        return None
+    return descriptions
+
+
+def describe_images_via_gemini(images: List[Tuple[bytes, str]], context: str = "") -> Optional[List[str]]:
+    """
+    以單次 Gemini 呼叫描述多張圖片（共用同一段 prompt / context）。
+    images: [(image_bytes, mime_type), ...]
+    回傳與 images 等長、依序對應的描述列表；回覆無法依「[圖片 N]」標記
+    完整拆分時回傳 None，由呼叫端改為逐張分析。
+    """
+    if not GENAI_AVAILABLE or not images:
+        return None
+    try:
+        model = genai.GenerativeModel('gemini-2.0-flash')
+
+        count = len(images)
+        context_line = f"這些圖片來自一則社群媒體貼文，貼文內容為：{context[:500]}\n\n" if context else ""
+        prompt_text = (
+            f"{context_line}"
+            f"以下依序附上 {count} 張圖片。請分別詳細描述每張圖片的內容，"
+            "包含圖片中可見的所有文字、數據、圖表或視覺資訊。\n"
+            f"每張圖片的描述請另起一行，並以「[圖片 N]」開頭（N 為 1 到 {count} 的順序編號），"
+            "不要加入其他前言或結語。"
+            "請使用繁體中文回答。"
+        )
+
+        parts = [prompt_text]
+        parts.extend({"mime_type": mime_type, "data": image_bytes} for image_bytes, mime_type in images)
+        response = model.generate_content(parts)
+        text = response.text.strip()
+
+        descriptions = _split_batch_reply(text, count)
+        if descriptions is None:
+            logger.warning(f"[image] Gemini 批次回覆無法拆分為 {count} 段，改為逐張分析")
+            return None
+
+        logger.info(f"[image] Gemini 批次描述成功，{count} 張圖片，{len(text)} 字元")
+        return descriptions
+
+    except Exception as e:
+        logger.error(f"[image] Gemini 批次分析錯誤: {e}")
+        return None
+
+
+async def analyze_images(image_urls: List[str], context: str = "", config: dict = None,
+                         client: Optional["httpx.AsyncClient"] = None) -> Optional[str]:
     """
     通用圖片分析模組（平台無關）。
     接收圖片 URL 列表，下載並透過 Gemini Vision 分析。
     回傳合併的圖片描述文字，或 None（若全部失敗）。
 
     config: 可選的設定 dict，支援鍵：
-        IMAGE_ANALYSIS_ENABLED, MAX_IMAGES_PER_MESSAGE, IMAGE_ANALYSIS_TIMEOUT
+        IMAGE_ANALYSIS_ENABLED, MAX_IMAGES_PER_MESSAGE, IMAGE_ANALYSIS_TIMEOUT, GEMINI_CONCURRENCY
+    client: 可選的共用 httpx.AsyncClient（沿用呼叫端的連線池）；未提供時臨時建立一個
     """
     cfg = config if config is not None else _DEFAULT_CONFIG
 
@@ -156,25 +273,82 @@ def analyze_images(image_urls: List[str], context: str = "", config: dict = None
         logger.info("[image] Gemini 不可用，跳過圖片分析")
         return None
 
-    if not image_urls:
+    if not image_urls or not _HTTPX_AVAILABLE:
         return None
 
+    if client is None:
+        async with httpx.AsyncClient(
+            follow_redirects=True, headers={"User-Agent": "TelegramClaudeBridge/2.6"}
+        ) as own_client:
+            return await analyze_images(image_urls, context, config, own_client)
+
     max_images = cfg.get("MAX_IMAGES_PER_MESSAGE", 5)
     timeout = cfg.get("IMAGE_ANALYSIS_TIMEOUT", 30)
     urls_to_process = image_urls[:max_images]
     logger.info(f"[image] 開始分析 {len(urls_to_process)} 張圖片")
 
+    # 各圖片並行下載；gather 保持順序，編號與原列表一致
+    downloads = await asyncio.gather(
+        *(download_image_bytes(client, img_url, timeout=timeout) for img_url in urls_to_process),
+        return_exceptions=True,
+    )
+    loaded = {}
+    for i, res in enumerate(downloads):
+        if isinstance(res, BaseException):
+            logger.error(f"[image] 圖片 {i+1} 下載錯誤: {res}")
+        elif res is not None:
+            loaded[i] = res
+
+    # 已描述過的圖片（相同內容 + 相同 context）直接取快取；
+    # 同一則貼文中重複的圖片也只送一份給 Gemini
+    keys = {i: _desc_cache_key(image_bytes, context) for i, (image_bytes, _) in loaded.items()}
+    described = {}
+    todo = {}  # cache key → 第一個使用該圖片的索引
+    for i, key in keys.items():
+        cached = _DESC_CACHE.get(key)
+        if cached is not None:
+            _DESC_CACHE.move_to_end(key)
+            described[i] = cached
+        else:
+            todo.setdefault(key, i)
+    if described:
+        logger.info(f"[image] {len(described)} 張圖片命中描述快取")
+
+    # 多張圖片合併成一次 Gemini 呼叫（省去多次往返與重複的 context prompt）；
+    # Gemini SDK 為同步呼叫，放到執行緒避免阻塞事件迴圈
+    fresh = {}
+    if len(todo) > 1:
+        batch = await run_gemini(
+            cfg, describe_images_via_gemini, [loaded[i] for i in todo.values()], context
+        )
+        if batch is not None:
+            fresh = dict(zip(todo, batch))
+
+    # 單張圖片或批次回覆無法拆分時，逐張並行分析
+    pending = [key for key in todo if key not in fresh]
+    if pending:
+        singles = await asyncio.gather(
+            *(run_gemini(cfg, describe_image_via_gemini, *loaded[todo[key]], context) for key in pending),
+            return_exceptions=True,
+        )
+        for key, desc in zip(pending, singles):
+            if isinstance(desc, BaseException):
+                logger.error(f"[image] 圖片 {todo[key]+1} 分析錯誤: {desc}")
+            elif desc:
+                fresh[key] = desc
+
+    for key, desc in fresh.items():
+        _desc_cache_put(key, desc)
+    for i, key in keys.items():
+        if key in fresh:
+            described[i] = fresh[key]
+
     descriptions = []
-    for i, img_url in enumerate(urls_to_process):
-        dl_result = download_image_to_base64(img_url, timeout=timeout)
-        if dl_result is None:
+    for i in range(len(urls_to_process)):
+        if i not in loaded:
             descriptions.append(f"[圖片 {i+1}] 下載失敗，無法分析")
-            continue
-
-        b64_data, mime_type = dl_result
-        desc = describe_image_via_gemini(b64_data, mime_type, context)
-        if desc:
-            descriptions.append(f"[圖片 {i+1}] {desc}")
+        elif i in described:
+            descriptions.append(f"[圖片 {i+1}] {described[i]}")
         else:
             descriptions.append(f"[圖片 {i+1}] 分析失敗，無法取得描述")
 